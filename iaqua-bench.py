@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+"""
+End-to-end load benchmark for the iAquaLink nodeserver against the local iAquaLink stand-in (iaquamock.py),
+and microbenchmark for the parsing of the get_home and get_devices response data
+
+Usage: python iaqua-bench.py --systems 12 --aux 15 --cycles 10 --commands 5 --latency 0.2
+       python iaqua-bench.py parser --iterations 20000
+"""
+
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import logging
+import timeit
+import tracemalloc
+import importlib.util
+from os.path import dirname, join, abspath
+
+import polyinterface
+import iaquaapi as api
+import iaquamock as mock
+
+# importing polyinterface redirects stdout and stderr to its log file and attaches a file handler,
+# so restore the console for the benchmark output
+polyinterface.unload_interface()
+
+# load the nodeserver module (the file name is not a valid module name)
+_spec = importlib.util.spec_from_file_location("iaqua_poly", join(dirname(abspath(__file__)), "iaqua-poly.py"))
+iaqua = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(iaqua)
+
+# interval between polls while waiting for command confirmation
+_CONFIRM_POLL_INTERVAL = 0.1 # seconds
+_CONFIRM_TIMEOUT = 30.0 # seconds
+
+# Stand-in for the Polyglot interface that records the messages the nodeserver sends
+class BenchPolyglot(object):
+
+    inQueue = None
+    config = None
+    messageCount = 0
+
+    def __init__(self):
+        self.inQueue = queue.Queue()
+        self.config = {"nodes": [], "customParams": {}, "notices": {}}
+
+    def onConfig(self, callback):
+        pass
+
+    def onStop(self, callback):
+        pass
+
+    def send(self, message):
+        self.messageCount += 1
+
+    def addNode(self, node):
+        self.messageCount += 1
+
+    def delNode(self, address):
+        self.messageCount += 1
+
+    def saveCustomData(self, data):
+        self.messageCount += 1
+
+    def saveCustomParams(self, data):
+        self.messageCount += 1
+
+    def addNotice(self, data):
+        self.messageCount += 1
+
+    def removeNotice(self, data):
+        self.messageCount += 1
+
+    def installprofile(self):
+        pass
+
+# return the percentile of a list of values
+def percentile(values, pct):
+
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+# summarize a list of timings in milliseconds
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 1) if values else 0.0,
+        "p50_ms": round(1000 * percentile(values, 50), 1),
+        "p95_ms": round(1000 * percentile(values, 95), 1),
+        "max_ms": round(1000 * max(values), 1) if values else 0.0,
+    }
+
+# start the nodeserver controller against the stand-in service and discover the nodes
+def startController(server, args):
+
+    poly = BenchPolyglot()
+    controller = iaqua.Controller(poly)
+    controller.polyConfig = {
+        "customData": {},
+        "customParams": {
+            iaqua.PARAM_USERNAME: "bench@example.com",
+            iaqua.PARAM_PASSWORD: "bench",
+            iaqua.PARAM_API_HOST: server.url,
+            iaqua.PARAM_MAX_POLL_THREADS: str(args.threads),
+        },
+        "shortPoll": 15,
+        "longPoll": 120,
+        "nodes": [],
+    }
+    controller.start()
+
+    # wait for the login and the first poll in the background
+    controller.serviceThread.join()
+    controller.discover()
+
+    return controller
+
+# measure the duration of full poll cycles and the number of requests and Polyglot messages per cycle
+def benchPollCycles(controller, service, args):
+
+    latencies = []
+    requests = []
+    messages = []
+
+    for cycle in range(args.cycles):
+
+        service.resetCounters()
+        messageCount = controller.poly.messageCount
+
+        start = time.perf_counter()
+        controller.updateNodeStates()
+        latencies.append(time.perf_counter() - start)
+
+        requests.append(service.getRequestCount())
+        messages.append(controller.poly.messageCount - messageCount)
+
+    return {
+        "latency": summarize(latencies),
+        "requests_per_cycle": round(sum(requests) / len(requests), 1) if requests else 0.0,
+        "messages_per_cycle": round(sum(messages) / len(messages), 1) if messages else 0.0,
+    }
+
+# measure the time from sending an On/Off command to an aux relay until a poll confirms the new state
+def benchCommands(controller, service, args):
+
+    # pick the on/off aux relay nodes to send commands to
+    nodes = [
+        node for system in controller.getSystemNodes()
+        for node in controller.getChildNodes(system.address)
+        if node.id == "DEVICE" and node.deviceName.startswith("aux_")
+    ]
+    if not nodes:
+        return {"confirmation": summarize([]), "handler": summarize([]), "timeouts": 0}
+
+    rand = random.Random(args.seed)
+    handlerTimes = []
+    confirmTimes = []
+    timeouts = 0
+
+    for n in range(args.commands):
+
+        node = rand.choice(nodes)
+        system = node.parent
+
+        # toggle the relay to the opposite of its current state in the service
+        target = "0" if service.getValue(system.serialNum, node.deviceName) == "1" else "1"
+        command = {"address": node.address, "cmd": "DON" if target == "1" else "DOF"}
+
+        start = time.perf_counter()
+        node.runCmd(command)
+        handlerTimes.append(time.perf_counter() - start)
+
+        # poll the system until the new state is reported
+        while True:
+            states = system.getNodeStates()
+            system.updateNodeStates(False, states)
+            devices = states[1]
+            if devices and devices.get(node.deviceName, {}).get("state") == target:
+                confirmTimes.append(time.perf_counter() - start)
+                break
+            if time.perf_counter() - start > _CONFIRM_TIMEOUT:
+                timeouts += 1
+                break
+            time.sleep(_CONFIRM_POLL_INTERVAL)
+
+    return {"confirmation": summarize(confirmTimes), "handler": summarize(handlerTimes), "timeouts": timeouts}
+
+# print the results as a text report
+def printReport(args, results):
+
+    print("iAquaLink nodeserver benchmark: %d system(s) x %d aux relay(s), latency %.3fs +%.3fs, error rate %.2f" % (
+        args.systems, args.aux, args.latency, args.jitter, args.error_rate))
+
+    polls = results["polls"]
+    print("")
+    print("Poll cycles:            %d" % polls["latency"]["count"])
+    print("  latency (ms):         mean %.1f  p50 %.1f  p95 %.1f  max %.1f" % (
+        polls["latency"]["mean_ms"], polls["latency"]["p50_ms"], polls["latency"]["p95_ms"], polls["latency"]["max_ms"]))
+    print("  requests per cycle:   %.1f" % polls["requests_per_cycle"])
+    print("  messages per cycle:   %.1f" % polls["messages_per_cycle"])
+
+    commands = results["commands"]
+    print("")
+    print("Commands:               %d (%d timed out)" % (commands["handler"]["count"], commands["timeouts"]))
+    print("  handler (ms):         mean %.1f  p50 %.1f  p95 %.1f  max %.1f" % (
+        commands["handler"]["mean_ms"], commands["handler"]["p50_ms"], commands["handler"]["p95_ms"], commands["handler"]["max_ms"]))
+    print("  to confirmation (ms): mean %.1f  p50 %.1f  p95 %.1f  max %.1f" % (
+        commands["confirmation"]["mean_ms"], commands["confirmation"]["p50_ms"], commands["confirmation"]["p95_ms"], commands["confirmation"]["max_ms"]))
+
+    print("")
+    print("HTTP connections:       %s" % json.dumps(results["connections"]))
+    print("State reads:            %s" % json.dumps(results["reads"]))
+    print("Rate limiter:           %s" % json.dumps(results["rateLimiter"]))
+    print("API latencies (s):      %s" % json.dumps(results["latencies"]))
+    print("API errors:             %s" % json.dumps(results["metrics"]["errors"]))
+    print("Bytes received:         %d" % results["metrics"]["bytesReceived"])
+    print("Token refreshes:        %s" % json.dumps(results["metrics"]["tokenRefresh"]))
+
+# the dictionary based parsing of the home screen response data replaced by SystemState (for comparison)
+def legacyBuildSystemState(data):
+
+    systemState = {}
+
+    for attr in data["home_screen"]:
+        systemState.update(attr)
+    
+    return systemState
+
+# the dictionary based parsing of the devices screen response data (for comparison)
+def legacyBuildDevicesState(data):
+
+    devices = {}
+
+    for device in data["devices_screen"][3:]:
+        key = list(device.keys())[0]
+        deviceState = {}
+        for attr in device[key]:
+            deviceState.update(attr)
+        devices[key] = deviceState
+
+    return devices
+
+# measure the time and memory allocated per call of a parsing function
+def measureParser(function, data, iterations):
+
+    seconds = min(timeit.repeat(lambda: function(data), number=iterations, repeat=7)) / iterations
+
+    # measure both the transient peak and the memory retained by the parsed state
+    tracemalloc.start()
+    result = function(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {"us_per_call": round(seconds * 1000000, 2), "peak_bytes": peak, "retained_bytes": retained}
+
+# compare the legacy and the record based parsing for realistic and oversized payloads
+def benchParser(args):
+
+    results = {}
+    for payload, auxDevices, extraAttributes in (("realistic", 7, 0), ("oversized", args.oversized_aux, args.oversized_attributes)):
+
+        # build the decoded response data from the stand-in service
+        service = mock.MockAqualinkService(systems=1, auxDevices=auxDevices, extraAttributes=extraAttributes)
+        system = next(iter(service.systems.values()))
+        homeData = json.loads(json.dumps(service._homeScreen(system)))
+        devicesData = json.loads(json.dumps(service._devicesScreen(system)))
+
+        results[payload] = {
+            "get_home": {
+                "legacy": measureParser(legacyBuildSystemState, homeData, args.iterations),
+                "records": measureParser(api.iAqualinkConnection._buildSystemState, homeData, args.iterations),
+            },
+            "get_devices": {
+                "legacy": measureParser(legacyBuildDevicesState, devicesData, args.iterations),
+                "records": measureParser(api.iAqualinkConnection._buildDevicesState, devicesData, args.iterations),
+            },
+        }
+
+    return results
+
+# print the parser results as a text report
+def printParserReport(args, results):
+
+    print("iAquaLink response parser microbenchmark: %d iterations" % args.iterations)
+    for payload, commands in results.items():
+        print("")
+        print("%s payload:" % payload.capitalize())
+        for command, parsers in commands.items():
+            legacy = parsers["legacy"]
+            records = parsers["records"]
+            print("  %-12s legacy %8.2f us %8d bytes   records %8.2f us %8d bytes   speedup %.2fx" % (
+                command, legacy["us_per_call"], legacy["retained_bytes"], records["us_per_call"], records["retained_bytes"],
+                legacy["us_per_call"] / records["us_per_call"] if records["us_per_call"] else 0.0))
+
+# Main function to run the benchmark
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the iAquaLink nodeserver.")
+    parser.add_argument("mode", nargs="?", choices=("e2e", "parser"), default="e2e", help="benchmark to run")
+    parser.add_argument("--systems", type=int, default=4, help="number of systems (pool controllers)")
+    parser.add_argument("--aux", type=int, default=7, help="number of aux relays per system")
+    parser.add_argument("--cycles", type=int, default=10, help="number of poll cycles to measure")
+    parser.add_argument("--commands", type=int, default=5, help="number of commands to measure")
+    parser.add_argument("--threads", type=int, default=iaqua.DEFAULT_MAX_POLL_THREADS, help="maxPollThreads for the nodeserver")
+    parser.add_argument("--latency", type=float, default=0.1, help="base response latency of the service (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="maximum random latency added (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    parser.add_argument("--apply-delay", type=float, default=0.5, help="delay before commands change the state (seconds)")
+    parser.add_argument("--extra-attributes", type=int, default=0, help="filler attributes added to each home screen")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the random number generators")
+    parser.add_argument("--iterations", type=int, default=20000, help="parser: iterations per measurement")
+    parser.add_argument("--oversized-aux", type=int, default=64, help="parser: aux relays in the oversized payload")
+    parser.add_argument("--oversized-attributes", type=int, default=200, help="parser: filler attributes in the oversized payload")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--log-level", default="WARNING", help="logging level for the nodeserver")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    iaqua.LOGGER.setLevel(args.log_level)
+
+    # run the parser microbenchmark
+    if args.mode == "parser":
+        results = benchParser(args)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            printParserReport(args, results)
+        sys.exit(0)
+
+    # start the stand-in service
+    service = mock.MockAqualinkService(
+        systems=args.systems,
+        auxDevices=args.aux,
+        latency=args.latency,
+        jitter=args.jitter,
+        errorRate=args.error_rate,
+        applyDelay=args.apply_delay,
+        extraAttributes=args.extra_attributes,
+        seed=args.seed,
+    )
+    server = mock.MockAqualinkServer(service).start()
+
+    try:
+        controller = startController(server, args)
+
+        results = {
+            "polls": benchPollCycles(controller, service, args),
+            "commands": benchCommands(controller, service, args),
+            "connections": controller.iaConn.getConnectionStats(),
+            "reads": controller.iaConn.getReadStats(),
+            "rateLimiter": controller.iaConn.getRateLimiterStats(),
+            "latencies": controller.iaConn.getLatencyStats(),
+            "metrics": controller.iaConn.getMetrics(),
+        }
+
+        controller.stop()
+
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        printReport(args, results)
+
+    sys.exit(0)
@@ -11,8 +11,14 @@ except ImportError:
     PGC = True
 import sys
 import re
+import logging
 import time
+import threading
+import zlib
+from collections import deque
 from math import ceil
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, Future
 import iaquaapi as api
 
 LOGGER = polyinterface.LOGGER
@@ -26,6 +32,8 @@ ISY_RAW_UOM = 56 # Raw value (for PH)
 ISY_PERCENT_UOM = 51 # For light level, as a percentage
 ISY_TEMP_F_UOM = 17 # UOM for temperatures (farenheit)
 ISY_TEMP_C_UOM = 4 # UOM for temperatures (celcius)
+ISY_MS_UOM = 42 # Milliseconds (for poll and API durations)
+ISY_SECONDS_UOM = 57 # Seconds (for the polling interval)
 
 # values for operation mode
 IX_SYS_OPMODE_OFF = 0
@@ -70,8 +78,70 @@ DEVICE_ADDR_SOLAR_HEAT = "solarht"
 PARAM_USERNAME = "username"
 PARAM_PASSWORD = "password"
 PARAM_SESSION_TTL = "sessionTTL"
+PARAM_MAX_POLL_THREADS = "maxPollThreads"
+PARAM_STATE_CACHE_AGE = "stateCacheAge"
+PARAM_HTTP_POOL_SIZE = "httpPoolSize"
+PARAM_API_HOST = "apiHost"
+PARAM_COALESCE_WINDOW = "coalesceWindow"
+PARAM_RATE_LIMIT = "rateLimit"
+PARAM_SYSTEM_RATE_LIMIT = "systemRateLimit"
+PARAM_MIN_HTTP_TIMEOUT = "minHttpTimeout"
+PARAM_MAX_HTTP_TIMEOUT = "maxHttpTimeout"
+PARAM_POLL_DEADLINE = "pollDeadline"
+PARAM_HEDGE_READS = "hedgeReads"
 
 DEFAULT_SESSION_TTL = 43200 # 12 hours
+DEFAULT_MAX_POLL_THREADS = 4 # maximum number of systems polled concurrently
+DEFAULT_STATE_CACHE_AGE = 10 # maximum age (seconds) of polled state used by commands
+DEFAULT_HTTP_POOL_SIZE = 10 # maximum keep-alive connections to the iAquaLink session API
+DEFAULT_COALESCE_WINDOW = 0.5 # window (seconds) for merging bursts of light brightness and setpoint commands
+DEFAULT_RATE_LIMIT = 10 # maximum requests per second to the iAquaLink service
+DEFAULT_SYSTEM_RATE_LIMIT = 2 # maximum requests per second to the iAquaLink service for each system
+DEFAULT_MIN_HTTP_TIMEOUT = 1.0 # floor (seconds) for the HTTP timeouts adapted from the observed latencies
+DEFAULT_POLL_DEADLINE = 10 # time (seconds) allowed for retrieving the states of the systems in a poll
+DEFAULT_SHORT_POLL = 15 # polling interval (seconds) right after a command
+DEFAULT_LONG_POLL = 120 # polling interval (seconds) when idle
+
+# version of the format of the custom data and the custom data key it is stored under
+# Note: custom data from earlier versions is migrated at startup (see migrateCustomData):
+#   1 (no version key) - system entries without the topology fingerprint
+#   2 - snapshot of the driver values of the nodes stored under SNAPSHOT_CUSTOM_DATA_KEY
+#   3 - current format
+CUSTOM_DATA_VERSION = 3
+CUSTOM_DATA_VERSION_KEY = "dataversion"
+SNAPSHOT_CUSTOM_DATA_KEY = "driversnapshot"
+CUSTOM_DATA_SAVE_DELAY = 2 # seconds a save is delayed to batch the changes made together (debounce)
+
+# maximum time a command is held for merging, in coalescing windows from when the command was first queued
+# Note: caps the hold of a continuously adjusted dimmer or setpoint, which would otherwise restart the window indefinitely
+COALESCE_MAX_WINDOWS = 4
+
+# number of consecutive discoveries a device must be missing from the system before its node is retired
+# Note: a single partial or odd devices response does not delete the node (and its programs and scenes) from the ISY
+RETIRE_AFTER_DISCOVERIES = 2
+
+# delays (seconds) between the retries of a failed login at startup - the last delay repeats
+STARTUP_RETRY_DELAYS = (5, 15, 30, 60, 120, 300)
+
+# constants for adapting the polling interval of the systems
+POLL_DECAY_FACTOR = 1.25 # growth of the polling interval after each poll, from shortPoll toward longPoll
+POLL_BACKOFF_MAX = 900 # maximum polling interval (seconds) while polls are failing
+POLL_OFFLINE_FACTOR = 2 # multiple of longPoll to poll systems that are not online
+
+# system state attributes that indicate device activity (used for detecting state changes)
+SYSTEM_STATE_ATTRIBUTES = (
+    "status",
+    api.DEVICE_NAME_PUMP,
+    api.DEVICE_NAME_SPA,
+    api.DEVICE_NAME_POOL_HEAT,
+    api.DEVICE_NAME_SPA_HEAT,
+    api.DEVICE_NAME_SOLAR_HEAT,
+    "pool_set_point",
+    "spa_set_point",
+)
+
+# placeholder in the driver maps for the temperature UOM of the system (see the driver maps below)
+UOM_SYSTEM_TEMP = -1
 
 # account for PGC 
 if PGC:
@@ -79,12 +149,244 @@ if PGC:
 else:
     NODE_DEF_ID_KEY = "node_def_id"
 
+# Class for scheduling the polls of a system (pool controller)
+# The polling interval starts at shortPoll after a command and decays toward longPoll with each
+# poll, backs off exponentially while polls are failing, and slows for systems that are not online
+class PollScheduler(object):
+
+    minInterval = DEFAULT_SHORT_POLL
+    maxInterval = DEFAULT_LONG_POLL
+    interval = DEFAULT_SHORT_POLL
+    delay = DEFAULT_SHORT_POLL
+    nextPoll = 0
+    failures = 0
+
+    def __init__(self, minInterval, maxInterval):
+        self.minInterval = minInterval
+        self.maxInterval = max(maxInterval, minInterval)
+
+        # start in active mode with a poll due immediately
+        self.interval = self.minInterval
+        self.delay = self.minInterval
+        self.nextPoll = 0
+
+    # reset the polling interval to the minimum and make a poll due immediately
+    def setActive(self):
+        self.interval = self.minInterval
+        self.delay = self.minInterval
+        self.nextPoll = min(self.nextPoll, time.time())
+
+    # determine whether a poll is due
+    def isDue(self, currentTime):
+
+        # allow half of the minimum interval as slack, since polls are only checked every shortPoll seconds
+        return currentTime >= self.nextPoll - self.minInterval / 2
+
+    # schedule the next poll based on the result of this poll and return the delay (seconds)
+    def pollCompleted(self, success, online=True):
+
+        if not success:
+
+            # back off exponentially while the polls are failing
+            self.failures += 1
+            delay = min(self.minInterval * (2 ** min(self.failures, 16)), max(POLL_BACKOFF_MAX, self.maxInterval))
+
+        else:
+            self.failures = 0
+            delay = self.interval
+
+            # poll systems that are not online less often than the idle interval
+            if not online:
+                delay = max(delay, self.maxInterval * POLL_OFFLINE_FACTOR)
+
+            # decay the polling interval toward the idle interval
+            self.interval = min(self.interval * POLL_DECAY_FACTOR, self.maxInterval)
+
+        self.delay = delay
+        self.nextPoll = time.time() + delay
+        return delay
+
+# Class for the custom data of the nodeserver that tracks the changed (dirty) keys and batches the saves
+# to Polyglot on a debounce timer
+# Note: Polyglot v2 replaces the custom data as a whole on each save, so each save sends all of the keys,
+# but a save is only sent if a key has changed, and a burst of changes is sent in a single save
+class CustomDataStore(object):
+
+    saveDelay = CUSTOM_DATA_SAVE_DELAY
+    saveCount = 0
+    _data = None
+    _dirtyKeys = None
+    _saveFunction = None
+    _timer = None
+    _lock = None
+
+    def __init__(self, data, saveFunction, saveDelay=CUSTOM_DATA_SAVE_DELAY):
+        self._data = dict(data or {})
+        self._dirtyKeys = set()
+        self._saveFunction = saveFunction
+        self.saveDelay = saveDelay
+        self._lock = threading.Lock()
+
+    # get the value for the key
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    # set the value for the key, marking the key dirty if the value changed
+    def set(self, key, value):
+        with self._lock:
+            if key not in self._data or self._data[key] != value:
+                self._data[key] = value
+                self._dirtyKeys.add(key)
+
+    # delete the key, marking the key dirty if it existed
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._dirtyKeys.add(key)
+
+    # get the keys changed since the last save
+    def getDirtyKeys(self):
+        with self._lock:
+            return set(self._dirtyKeys)
+
+    # save the custom data after the save delay if any key changed - the changes made in the meantime
+    # are included in the same save
+    def save(self):
+        with self._lock:
+            if not self._dirtyKeys or self._timer is not None:
+                return
+            self._timer = threading.Timer(self.saveDelay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    # save the custom data now if any key changed
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirtyKeys:
+                return
+            LOGGER.debug("Saving custom data - changed keys: %s", ", ".join(sorted(self._dirtyKeys)))
+            self._dirtyKeys.clear()
+            self.saveCount += 1
+            data = dict(self._data)
+
+        self._saveFunction(data)
+
+# Class for an ordered queue of commands for a system (pool controller) served by a worker thread
+# so that the command handlers return without waiting on the API calls
+# Commands with a coalescing key are held for the coalescing window, and a burst of commands with the
+# same key (e.g., BRT/DIM from holding a dimmer key) is merged into a single API call
+class CommandQueue(object):
+
+    name = ""
+    coalesceWindow = 0
+    _commands = None
+    _condition = None
+    _stopped = False
+    _worker = None
+
+    def __init__(self, name, coalesceWindow=0):
+        self.name = name
+        self.coalesceWindow = coalesceWindow
+        self._commands = deque()
+        self._condition = threading.Condition()
+
+        # start the worker thread for the queue
+        self._worker = threading.Thread(target=self._run, name="Commands-" + name, daemon=True)
+        self._worker.start()
+
+    # add a command to the end of the queue, or merge it into the command at the end of the queue if it has
+    # the same coalescing key
+    # Note: execute(**args) returns True if the API call succeeded, and then complete() is called with the
+    # result - both are called on the worker thread
+    def put(self, description, execute, complete=None, key=None, args=None):
+
+        args = args or {}
+        currentTime = time.time()
+        with self._condition:
+
+            # merge the command into the last waiting command if it has the same key - the arguments of the
+            # later command take precedence and the coalescing window restarts, up to the maximum hold
+            # Note: only the last command is merged so that commands are not reordered ahead of the commands
+            # queued in between
+            if key is not None and self._commands and self._commands[-1]["key"] == key:
+                command = self._commands[-1]
+                command["description"] = description
+                command["execute"] = execute
+                command["args"].update(args)
+                command["dueTime"] = min(currentTime + self.coalesceWindow, command["maxDueTime"])
+                if complete is not None:
+                    command["complete"].append(complete)
+                LOGGER.debug("Coalesced %s command for system %s.", description, self.name)
+                return
+
+            dueTime = currentTime + (self.coalesceWindow if key is not None else 0)
+            self._commands.append({
+                "description": description,
+                "execute": execute,
+                "args": dict(args),
+                "complete": [] if complete is None else [complete],
+                "key": key,
+                "dueTime": dueTime,
+                "maxDueTime": currentTime + self.coalesceWindow * COALESCE_MAX_WINDOWS,
+            })
+            self._condition.notify()
+
+    # get the number of commands waiting in the queue
+    def pending(self):
+        with self._condition:
+            return len(self._commands)
+
+    # stop the worker thread after the queued commands are executed
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    # execute the queued commands in order until stopped
+    def _run(self):
+
+        while True:
+
+            # wait for the command at the head of the queue to be due
+            with self._condition:
+                while True:
+                    if self._commands:
+                        delay = self._commands[0]["dueTime"] - time.time()
+                        if delay <= 0:
+                            command = self._commands.popleft()
+                            break
+                    elif self._stopped:
+                        return
+                    else:
+                        delay = None
+                    self._condition.wait(delay)
+
+            try:
+                success = command["execute"](**command["args"])
+            except Exception as e:
+                LOGGER.error("Error executing %s command for system %s: %s", command["description"], self.name, str(e))
+                success = False
+
+            # call the completion functions of merged commands from the last to the first, so that
+            # drivers restored on failure end up at the values from before the first command
+            for complete in reversed(command["complete"]):
+                try:
+                    complete(success)
+                except Exception as e:
+                    LOGGER.error("Error completing %s command for system %s: %s", command["description"], self.name, str(e))
+
 # Node class for devices (pumps and aux relays)
 class Device(polyinterface.Node):
 
     id = "DEVICE"
     hint = [0x01, 0x04, 0x02, 0x00] # Residential/Relay/On/Off Power Switch
     deviceName = ""
+    driverUpdater = None
+    driverAttributes = None
 
     def __init__(self, controller, primary, addr, name, deviceName=None):
         super(Device, self).__init__(controller, primary, addr, name)
@@ -110,6 +412,20 @@ class Device(polyinterface.Node):
 
         LOGGER.info("Turn on %s in DON command handler: %s", self.deviceName, str(command))
 
+        # queue the toggle and update the state value ahead of the API call
+        self.controller.queueCommand(self, "DON", self._toggleOn, "ST", IX_DEV_ST_ON)
+
+    # Turn off the device
+    def cmd_dof(self, command):
+
+        LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
+
+        # queue the toggle and update the state value ahead of the API call
+        self.controller.queueCommand(self, "DOF", self._toggleOff, "ST", IX_DEV_ST_OFF)
+
+    # Toggle the device on if it is off (called from the command queue)
+    def _toggleOn(self):
+
         # retrieve the current state of the device since we are toggling
         currentState = self.controller.iaConn.getDeviceState(self.parent.serialNum, self.deviceName)
 
@@ -119,20 +435,15 @@ class Device(polyinterface.Node):
 
             # call the api to toggle the state of the device
             if self.controller.iaConn.toggleDeviceState(self.parent.serialNum, self.deviceName):
-
-                # Update the state value
-                self.setDriver("ST", IX_DEV_ST_ON)
-            
+                return True
             else:
                 LOGGER.error("Call to API toggleDeviceState() failed in DON command handler.")
+                return False
 
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        return currentState in (api.DEVICE_STATE_ON, api.DEVICE_STATE_ENABLED)
 
-    # Turn off the device
-    def cmd_dof(self, command):
-
-        LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
+    # Toggle the device off if it is on (called from the command queue)
+    def _toggleOff(self):
 
         # retrieve the current state of the device since we are toggling
         currentState = self.controller.iaConn.getDeviceState(self.parent.serialNum, self.deviceName)
@@ -143,15 +454,12 @@ class Device(polyinterface.Node):
             
             # call the api to toggle the state of the device
             if self.controller.iaConn.toggleDeviceState(self.parent.serialNum, self.deviceName):
-
-                # Update the state value
-                self.setDriver("ST", IX_DEV_ST_OFF)
-            
+                return True
             else:
                 LOGGER.error("Call to API toggleDeviceState() failed in DOF command handler.")
+                return False
 
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        return currentState == api.DEVICE_STATE_OFF
 
     drivers = [{"driver": "ST", "value": IX_DEV_ST_UNKNOWN, "uom": ISY_INDEX_UOM}]
     commands = {
@@ -165,6 +473,8 @@ class DimmingLight(polyinterface.Node):
     id = "DIMMING_LIGHT"
     hint = [0x01, 0x02, 0x0a, 0x00] # Residential/Controller/Multi-level Switch
     deviceName = ""
+    driverUpdater = None
+    driverAttributes = None
 
     def __init__(self, controller, primary, addr, name, deviceName=None):
         super(DimmingLight, self).__init__(controller, primary, addr, name)
@@ -197,34 +507,18 @@ class DimmingLight(polyinterface.Node):
             # retrieve the parameter value (%) for the command - ensure it is divisible by 25 and max 100
             value = str(min(ceil(int(command.get("value")) /25), 4) * 25)
 
-        # call the set_light API
-        if self.controller.iaConn.setLightBrightness(self.parent.serialNum, self.deviceName, value):
-        
-            # update state driver to the brightness set
-            self.setDriver("ST", int(value))
-
-        else:
-            LOGGER.warning("Call to setLightBrightness() failed in DON command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        # queue the set_light API call and update state driver to the brightness set ahead of the API call
+        # Note: set_light calls for the light within the coalescing window are merged into one
+        self.controller.queueCommand(self, "DON", self._setBrightness, "ST", int(value), key=("set_light", self.deviceName), args={"value": value, "commandName": "DON"})
 
     # Turn off the device
     def cmd_dof(self, command):
 
         LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
 
-        # call the set_light API
-        if self.controller.iaConn.setLightBrightness(self.parent.serialNum, self.deviceName, "0"):
-        
-            # update state driver to the brightness set
-            self.setDriver("ST", 0)
-
-        else:
-            LOGGER.warning("Call to setLightBrightness() failed in DOF command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        # queue the set_light API call and update state driver to the brightness set ahead of the API call
+        # Note: set_light calls for the light within the coalescing window are merged into one
+        self.controller.queueCommand(self, "DOF", self._setBrightness, "ST", 0, key=("set_light", self.deviceName), args={"value": "0", "commandName": "DOF"})
 
     # Turn off the device
     def cmd_brt(self, command):
@@ -233,21 +527,13 @@ class DimmingLight(polyinterface.Node):
 
         # calculate new value from current brightness
         # note values can only be 0, 25, 50, 75, and 100%
-        x = int(self.getDriver("ST"))
+        # Note: use the local driver value since it is updated ahead of queued commands
+        x = getDriverValue(self, "ST")
         value = str(min(ceil(int(x) /25) + 1, 4) * 25)
 
-
-        # call the set_light API
-        if self.controller.iaConn.setLightBrightness(self.parent.serialNum, self.deviceName, value):
-        
-            # update state driver to the brightness set
-            self.setDriver("ST", int(value))
-
-        else:
-            LOGGER.warning("Call to setLightBrightness() failed in BRT command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        # queue the set_light API call and update state driver to the brightness set ahead of the API call
+        # Note: set_light calls for the light within the coalescing window are merged into one
+        self.controller.queueCommand(self, "BRT", self._setBrightness, "ST", int(value), key=("set_light", self.deviceName), args={"value": value, "commandName": "BRT"})
 
     # Turn off the device
     def cmd_dim(self, command):
@@ -256,20 +542,23 @@ class DimmingLight(polyinterface.Node):
 
         # calculate new value from current brightness
         # note values can only be 0, 25, 50, 75, and 100%
-        x = int(self.getDriver("ST"))
+        # Note: use the local driver value since it is updated ahead of queued commands
+        x = getDriverValue(self, "ST")
         value = str(max(ceil(int(x) /25) - 1, 0) * 25)
 
+        # queue the set_light API call and update state driver to the brightness set ahead of the API call
+        # Note: set_light calls for the light within the coalescing window are merged into one
+        self.controller.queueCommand(self, "DIM", self._setBrightness, "ST", int(value), key=("set_light", self.deviceName), args={"value": value, "commandName": "DIM"})
+
+    # Set the brightness of the light (called from the command queue)
+    def _setBrightness(self, value, commandName):
+
         # call the set_light API
         if self.controller.iaConn.setLightBrightness(self.parent.serialNum, self.deviceName, value):
-        
-            # update state driver to the brightness set
-            self.setDriver("ST", int(value))
-
+            return True
         else:
-            LOGGER.warning("Call to setLightBrightness() failed in DIM command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+            LOGGER.warning("Call to setLightBrightness() failed in %s command handler.", commandName)
+            return False
     
     drivers = [{"driver": "ST", "value": 0, "uom": ISY_PERCENT_UOM}]
     commands = {
@@ -287,6 +576,8 @@ class ColorLight(polyinterface.Node):
     id = "COLOR_LIGHT"
     hint = [0x01, 0x04, 0x02, 0x00] # Residential/Relay/On/Off Power Switch
     deviceName = ""
+    driverUpdater = None
+    driverAttributes = None
     _lightType = ""
 
     def __init__(self, controller, primary, addr, name, deviceName=None, lightType=None):
@@ -329,34 +620,26 @@ class ColorLight(polyinterface.Node):
             # retrieve the effect parameter value for the command 
             value = str(command.get("value"))
 
-        # call the set_effect API
-        if self.controller.iaConn.setLightEffect(self.parent.serialNum, self.deviceName, value, self._lightType):
-        
-            # update state driver to reflect it was turned on
-            self.setDriver("ST", IX_DEV_ST_ON)
-
-        else:
-            LOGGER.warning("Call to setLightEffect() failed in DON command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        # queue the set_effect API call and update state driver to reflect it was turned on ahead of the API call
+        self.controller.queueCommand(self, "DON", lambda: self._setEffect(value, "DON"), "ST", IX_DEV_ST_ON)
 
     # Turn off the device
     def cmd_dof(self, command):
 
         LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
 
-        # call the set_effect API
-        if self.controller.iaConn.setLightEffect(self.parent.serialNum, self.deviceName, "0", self._lightType):
-        
-            # update state driver to the brightness set
-            self.setDriver("ST", IX_DEV_ST_OFF)
+        # queue the set_effect API call and update state driver ahead of the API call
+        self.controller.queueCommand(self, "DOF", lambda: self._setEffect("0", "DOF"), "ST", IX_DEV_ST_OFF)
 
-        else:
-            LOGGER.warning("Call to setLightEffect() failed in DOF command handler.")
+    # Set the effect of the light (called from the command queue)
+    def _setEffect(self, value, commandName):
 
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        # call the set_effect API
+        if self.controller.iaConn.setLightEffect(self.parent.serialNum, self.deviceName, value, self._lightType):
+            return True
+        else:
+            LOGGER.warning("Call to setLightEffect() failed in %s command handler.", commandName)
+            return False
 
     drivers = [{"driver": "ST", "value": IX_DEV_ST_UNKNOWN, "uom": ISY_INDEX_UOM}]
     commands = {
@@ -372,6 +655,8 @@ class TempControl(polyinterface.Node):
     id = "TEMP_CONTROL"
     hint = [0x01, 0x0C, 0x01, 0x00] # Residential/HVAC/Thermostat
     deviceName = ""
+    driverUpdater = None
+    driverAttributes = None
 
     # Override init to handle temp units
     def __init__(self, controller, primary, addr, name, deviceName=None):
@@ -404,6 +689,41 @@ class TempControl(polyinterface.Node):
 
         LOGGER.info("Turn on %s in DON command handler: %s", self.deviceName, str(command))
 
+        # queue the toggle and update the state value ahead of the API call
+        self.controller.queueCommand(self, "DON", self._toggleOn, "ST", IX_DEV_ST_ENABLED)
+
+    # Turn off the heater
+    def cmd_dof(self, command):
+
+        LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
+
+        # queue the toggle and update the state value ahead of the API call
+        self.controller.queueCommand(self, "DOF", self._toggleOff, "ST", IX_DEV_ST_OFF)
+
+    # Set setpoint temperature for heater
+    def cmd_set_temp(self, command):
+        
+        LOGGER.info("Set setpoint for %s in SET_SPH command handler: %s", self.deviceName, str(command))
+
+        value = int(command.get("value"))
+
+        # determine setpoint to change based on device ID
+        if self.deviceName == api.DEVICE_NAME_POOL_HEAT and self.parent.hasSpa:
+            spName = "temp2"
+        elif self.deviceName in (api.DEVICE_NAME_POOL_HEAT, api.DEVICE_NAME_SPA_HEAT):
+            spName = "temp1"
+        else:
+            LOGGER.warning("No setpoint for %s - SET_SPH command ignored.", self.address)
+            return
+
+        # queue the setting of the setpoint element and update the setpoint value ahead of the API call
+        # Note: set_temps calls for the system within the coalescing window, including the setpoints of both
+        # the pool and spa heaters, are merged into one
+        self.controller.queueCommand(self, "SET_SPH", self._setTemps, "CLISPH", value, uom=self.parent.tempUOM, key="set_temps", args={spName: value})
+
+    # Toggle the heater on if it is off (called from the command queue)
+    def _toggleOn(self):
+
         # retrieve the current state of the device since we are toggling
         currentState = self.controller.iaConn.getDeviceState(self.parent.serialNum, self.deviceName)
 
@@ -413,20 +733,15 @@ class TempControl(polyinterface.Node):
 
             # call the api to toggle the state of the device
             if self.controller.iaConn.toggleDeviceState(self.parent.serialNum, self.deviceName):
-
-                # Update the state value
-                self.setDriver("ST", IX_DEV_ST_ENABLED)
-            
+                return True
             else:
                 LOGGER.error("Call to API toggleDeviceState() failed in DON command handler.")
+                return False
 
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+        return currentState in (api.DEVICE_STATE_ON, api.DEVICE_STATE_ENABLED)
 
-    # Turn off the heater
-    def cmd_dof(self, command):
-
-        LOGGER.info("Turn off %s in DOF command handler: %s", self.deviceName, str(command))
+    # Toggle the heater off if it is on (called from the command queue)
+    def _toggleOff(self):
 
         # retrieve the current state of the device since we are toggling
         currentState = self.controller.iaConn.getDeviceState(self.parent.serialNum, self.deviceName)
@@ -437,43 +752,21 @@ class TempControl(polyinterface.Node):
             
             # call the api to toggle the state of the device
             if self.controller.iaConn.toggleDeviceState(self.parent.serialNum, self.deviceName):
-
-                # Update the state value
-                self.setDriver("ST", IX_DEV_ST_OFF)
-            
+                return True
             else:
                 LOGGER.error("Call to API toggleDeviceState() failed in DOF command handler.")
+                return False
 
-         # Place the controller in active polling mode
-        self.controller.setActiveMode()
-
-    # Set setpoint temperature for heater
-    def cmd_set_temp(self, command):
-        
-        LOGGER.info("Set setpoint for %s in SET_SPH command handler: %s", self.deviceName, str(command))
+        return currentState == api.DEVICE_STATE_OFF
 
-        value = int(command.get("value"))
-
-        # determine setpoint to change based on device ID
-        if self.deviceName == api.DEVICE_NAME_POOL_HEAT and self.parent.hasSpa:
-            spName = "temp2"
-        elif self.deviceName in (api.DEVICE_NAME_POOL_HEAT, api.DEVICE_NAME_SPA_HEAT):
-            spName = "temp1"
-        else:
-            LOGGER.warning("No setpoint for %s - SET_SPH command ignored.", self.address)
-            return
-
-        # set the setpoint element
-        if self.controller.iaConn.setTemps(self.parent.serialNum, **({spName: value})):
-
-                # Update the state value
-                self.setDriver("CLISPH", value, uom=self.parent.tempUOM)
+    # Set the setpoint elements - temp1 and/or temp2 (called from the command queue)
+    def _setTemps(self, **temps):
 
+        if self.controller.iaConn.setTemps(self.parent.serialNum, **temps):
+            return True
         else:
             LOGGER.error("Call to API setTemps() failed in SET_SPH command handler.")
-
-        # Place the controller in active polling mode
-        self.controller.setActiveMode()
+            return False
 
     drivers = [
         {"driver": "ST", "value": IX_DEV_ST_UNKNOWN, "uom": ISY_INDEX_UOM},
@@ -494,6 +787,15 @@ class System(polyinterface.Node):
     serialNum = ""
     hasSpa = False
     tempUOM = ISY_TEMP_F_UOM
+    topologyFingerprint = ""
+    driverUpdater = None
+    driverAttributes = None
+    pollScheduler = None
+    _discoveredStates = None
+    _missingCounts = None
+    _lastSystemState = None
+    _lastDevices = None
+    _driversStale = False
 
     def __init__(self, controller, primary, addr, name, serialNum=None):
         super(System, self).__init__(controller, addr, addr, name) # send its own address as primary
@@ -501,6 +803,12 @@ class System(polyinterface.Node):
         # make the system a primary node
         self.isPrimary = True
 
+        # setup the polling schedule for the system from the controller's polling intervals
+        self.pollScheduler = PollScheduler(controller.minPollInterval, controller.maxPollInterval)
+
+        # number of consecutive discoveries each missing device has been missing from the system
+        self._missingCounts = {}
+
         # if the node is being rebuilt in startup, then just set the instance variables
         if serialNum is None:
         
@@ -509,6 +817,7 @@ class System(polyinterface.Node):
             self.serialNum = cData[0]
             self.hasSpa = (cData[1] == "True")
             self.tempUOM = int(cData[2])
+            self.topologyFingerprint = cData[3]
 
         else:
             
@@ -522,18 +831,26 @@ class System(polyinterface.Node):
 
         LOGGER.info("Updating node states for system %s in cmd_update()...", self.name)
         
-        # Update all of the node values for the node and child nodes
-        self.updateNodeStates(True)
+        # Update all of the node values for the node and child nodes, holding the poll lock so that the
+        # update does not run at the same time as a poll or discovery
+        with self.controller._pollLock:
+            self.updateNodeStates(True)
 
-        self.controller.setActiveMode()
+        # Place the system in active polling mode
+        self.controller.setActiveMode(self.serialNum)
 
-    # build the child nodes from the system
-    def discoverDevices(self):
+    # build the child nodes from the system, adding, replacing, or retiring only the nodes whose
+    # topology changed since the last discovery
+    # Note: the states retrieved for the discovery are used for the next poll of the system
+    # Note: nodes are retired only after their devices are missing from RETIRE_AFTER_DISCOVERIES discoveries
+    def discoverDevices(self, states=None):
 
         LOGGER.info("Building child nodes for system %s in discoverDevices()...", self.name)
 
-        # get the system state from the API
-        systemState = self.controller.iaConn.getSystemState(self.serialNum) 
+        # get the system and devices state from the API if not already retrieved
+        if states is None:
+            states = self.getNodeStates()
+        systemState, devices = states
 
         if systemState and systemState["status"] == "Online":
 
@@ -543,203 +860,247 @@ class System(polyinterface.Node):
             else:
                 self.tempUOM = ISY_TEMP_F_UOM
 
-            # add device node for main pump with this system as primary, if it doesn't exist
-            devAddr = getValidNodeAddress(self.address + "_" + DEVICE_ADDR_PUMP)
-            if devAddr not in self.controller.nodes: 
-                node = Device(
-                    self.controller,
-                    self.address,
-                    devAddr,
-                    getValidNodeName(DEVICE_LABEL_PUMP),
-                    api.DEVICE_NAME_PUMP
-                )
-                self.controller.addNode(node)
-
-            # if the system has a pool heater, add a thermostat node for the pool heater
-            if systemState[api.DEVICE_NAME_POOL_HEAT] != "":
-
-                LOGGER.info("System %s has a pool heater.", self.name)
-
-                devAddr = getValidNodeAddress(self.address + "_" + DEVICE_ADDR_POOL_HEAT)
-                if devAddr not in self.controller.nodes: 
-                    node = TempControl(
-                        self.controller,
-                        self.address,
-                        devAddr,
-                        getValidNodeName(DEVICE_LABEL_POOL_HEAT),
-                        api.DEVICE_NAME_POOL_HEAT
-                    )
-                    self.controller.addNode(node)
-
-            # if the system has a spa, add the corresponding nodes
-            if systemState[api.DEVICE_NAME_SPA] != "":
-
-                LOGGER.info("System %s has a spa.", self.name)
-                self.hasSpa = True
-
-                # add device node for the spa with this system as primary
-                devAddr = getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SPA)
-                if devAddr not in self.controller.nodes: 
-                    node = Device(
-                        self.controller,
-                        self.address,
-                        devAddr,
-                        getValidNodeName(DEVICE_LABEL_SPA),
-                        api.DEVICE_NAME_SPA
-                    )
-                    self.controller.addNode(node)
-
-                # if the system has a spa heater, add a thermostat node for the spa heater
-                if systemState[api.DEVICE_NAME_SPA_HEAT] != "":
-
-                    devAddr = getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SPA_HEAT)
-                    if devAddr not in self.controller.nodes: 
-                        node = TempControl(
-                            self.controller,
-                            self.address,
-                            devAddr,
-                            getValidNodeName(DEVICE_LABEL_SPA_HEAT),
-                            api.DEVICE_NAME_SPA_HEAT
-                        )
-                        self.controller.addNode(node)
-
-            # if the system has a solar heater, add a device node for the solar heater
-            if systemState[api.DEVICE_NAME_SOLAR_HEAT] != "":
-
-                LOGGER.info("System %s has a solar heater.", self.name)
-
-                devAddr = getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SOLAR_HEAT)
-                if devAddr not in self.controller.nodes: 
-                    node = Device(
-                        self.controller,
-                        self.address,
-                        devAddr,
-                        getValidNodeName(DEVICE_LABEL_SOLAR_HEAT),
-                        api.DEVICE_NAME_SOLAR_HEAT
-                    )
-                    self.controller.addNode(node)
-
-            # get a listing of aux devices
-            devices = self.controller.iaConn.getDevicesList(self.serialNum) 
+            self.hasSpa = systemState[api.DEVICE_NAME_SPA] != ""
+
+            # recompile the driver updaters of the system and its existing nodes for the temperature UOM
+            compileDriverUpdater(self)
+            for node in self.controller.getChildNodes(self.address):
+                compileDriverUpdater(node)
+
             if not devices:
                 LOGGER.warning("System %s getDevicesList() returned no devices.", self.name)
 
+            # build the specifications of the child nodes and the fingerprint of the topology
+            # Note: a partial topology (devices not retrieved) is not fingerprinted
+            nodeSpecs = self._getNodeSpecs(systemState, devices)
+            fingerprint = ""
+            if devices:
+                topology = [self.tempUOM, self.hasSpa] + [(addr, nodeDefID, args) for addr, name, nodeDefID, nodeClass, args in nodeSpecs]
+                fingerprint = "%08x" % zlib.crc32(repr(topology).encode())
+
+            if fingerprint and fingerprint == self.topologyFingerprint and all(spec[0] in self.controller.nodes for spec in nodeSpecs):
+                LOGGER.info("Topology of system %s is unchanged.", self.name)
+
             else:
 
-                # iterate devices
-                for devID in devices:
-                    device = devices[devID]
-
-                    LOGGER.info("System %s has device %s labeled %s of type %s.", self.name, devID, device["label"], device["type"])
-
-                    # If no node already exists for the device address, then add a node for the device
-                    devAddr = getValidNodeAddress(self.address + "_" + devID)                         
-                    if devAddr not in self.controller.nodes: 
-                        
-                        # add a dimmable relay node
-                        if device["type"] == api.DEVICE_TYPE_DIMMABLE_RELAY:
-                            node = DimmingLight(
-                                self.controller,
-                                self.address,
-                                devAddr,
-                                getValidNodeName(device["label"]),
-                                devID
-                            )
-                        elif device["type"] == api.DEVICE_TYPE_COLOR_LIGHT:
-                            node = ColorLight(
-                                self.controller,
-                                self.address,
-                                devAddr,
-                                getValidNodeName(device["label"]),
-                                devID,
-                                device["subtype"]
-                            )
+                # add the nodes that do not exist and replace the nodes whose type changed
+                existing = {node.address: node for node in self.controller.getChildNodes(self.address)}
+                for addr, name, nodeDefID, nodeClass, args in nodeSpecs:
+                    node = existing.pop(addr, None)
+                    if node is not None and node.id == nodeDefID:
+                        continue
+
+                    # delete the node whose type changed before adding the node of the new type
+                    if node is not None:
+                        LOGGER.info("Replacing node %s for system %s - type changed from %s to %s.", addr, self.name, node.id, nodeDefID)
+                        self.controller.delNode(addr)
+                    else:
+                        LOGGER.info("Adding node %s for system %s.", addr, self.name)
+                    self.controller.addNode(nodeClass(self.controller, self.address, addr, getValidNodeName(name), *args))
+
+                # retire the nodes for devices missing from the system for RETIRE_AFTER_DISCOVERIES discoveries,
+                # unless the devices were not retrieved
+                pendingRetirement = False
+                if devices:
+                    self._missingCounts = {addr: self._missingCounts.get(addr, 0) + 1 for addr in existing}
+                    for addr, count in self._missingCounts.items():
+                        if count >= RETIRE_AFTER_DISCOVERIES:
+                            LOGGER.info("Retiring node %s for system %s - device no longer present.", addr, self.name)
+                            self.controller.delNode(addr)
                         else:
-                            node = Device(
-                                self.controller,
-                                self.address,
-                                devAddr,
-                                getValidNodeName(device["label"]),
-                                devID
-                            )
+                            LOGGER.warning("Device for node %s of system %s is missing - the node is retired if the device is still missing after %d more discovery(s).", addr, self.name, RETIRE_AFTER_DISCOVERIES - count)
+                            pendingRetirement = True
+                    self._missingCounts = {addr: count for addr, count in self._missingCounts.items() if count < RETIRE_AFTER_DISCOVERIES}
 
-                        self.controller.addNode(node)
+                # keep the fingerprint of the topology only once it is complete, so that the next discovery
+                # checks the missing devices again
+                self.topologyFingerprint = "" if pendingRetirement else fingerprint
 
             # store instance variables in polyglot custom data
-            cData = ";".join([self.serialNum, str(self.hasSpa), str(self.tempUOM)])
+            cData = ";".join([self.serialNum, str(self.hasSpa), str(self.tempUOM), self.topologyFingerprint])
             self.controller.addCustomData(self.address, cData)
 
+            # keep the states for the next poll
+            self._discoveredStates = (states, time.time())
+
             return True
 
         else:
             return False
 
-    # update the state of all child nodes for this pool controller (system)
-    def updateNodeStates(self, forceReport=False):
-        
+    # build the specifications (address, name, node def ID, node class, and device args) of the child
+    # nodes for the system devices and the aux relays in the state data
+    def _getNodeSpecs(self, systemState, devices):
+
+        tempControlID = "TEMP_CONTROL_C" if self.tempUOM == ISY_TEMP_C_UOM else "TEMP_CONTROL"
+
+        # device node for main pump
+        nodeSpecs = [(getValidNodeAddress(self.address + "_" + DEVICE_ADDR_PUMP), DEVICE_LABEL_PUMP, "DEVICE", Device, (api.DEVICE_NAME_PUMP,))]
+
+        # if the system has a pool heater, a thermostat node for the pool heater
+        if systemState[api.DEVICE_NAME_POOL_HEAT] != "":
+            LOGGER.info("System %s has a pool heater.", self.name)
+            nodeSpecs.append((getValidNodeAddress(self.address + "_" + DEVICE_ADDR_POOL_HEAT), DEVICE_LABEL_POOL_HEAT, tempControlID, TempControl, (api.DEVICE_NAME_POOL_HEAT,)))
+
+        # if the system has a spa, a device node for the spa and a thermostat node for the spa heater, if any
+        if systemState[api.DEVICE_NAME_SPA] != "":
+            LOGGER.info("System %s has a spa.", self.name)
+            nodeSpecs.append((getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SPA), DEVICE_LABEL_SPA, "DEVICE", Device, (api.DEVICE_NAME_SPA,)))
+            if systemState[api.DEVICE_NAME_SPA_HEAT] != "":
+                nodeSpecs.append((getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SPA_HEAT), DEVICE_LABEL_SPA_HEAT, tempControlID, TempControl, (api.DEVICE_NAME_SPA_HEAT,)))
+
+        # if the system has a solar heater, a device node for the solar heater
+        if systemState[api.DEVICE_NAME_SOLAR_HEAT] != "":
+            LOGGER.info("System %s has a solar heater.", self.name)
+            nodeSpecs.append((getValidNodeAddress(self.address + "_" + DEVICE_ADDR_SOLAR_HEAT), DEVICE_LABEL_SOLAR_HEAT, "DEVICE", Device, (api.DEVICE_NAME_SOLAR_HEAT,)))
+
+        # a node for each aux device based on the device type
+        for devID, device in (devices or {}).items():
+
+            LOGGER.info("System %s has device %s labeled %s of type %s.", self.name, devID, device["label"], device["type"])
+
+            devAddr = getValidNodeAddress(self.address + "_" + devID)
+            if device["type"] == api.DEVICE_TYPE_DIMMABLE_RELAY:
+                nodeSpecs.append((devAddr, device["label"], "DIMMING_LIGHT", DimmingLight, (devID,)))
+            elif device["type"] == api.DEVICE_TYPE_COLOR_LIGHT:
+                nodeSpecs.append((devAddr, device["label"], DEVICE_COLOR_LIGHT_TYPES.get(device["subtype"], "COLOR_LIGHT_JC"), ColorLight, (devID, device["subtype"])))
+            else:
+                nodeSpecs.append((devAddr, device["label"], "DEVICE", Device, (devID,)))
+
+        return nodeSpecs
+
+    # get the states retrieved by the last discovery for the next poll, if recent enough (once only)
+    def takeDiscoveredStates(self):
+
+        discovered, self._discoveredStates = self._discoveredStates, None
+        if discovered is not None and time.time() - discovered[1] < self.pollScheduler.minInterval:
+            return discovered[0]
+        else:
+            return None
+
+    # retrieve the state of the system and the devices (aux relays) from the API
+    # Note: this may be called from a polling worker thread, so no drivers are updated here
+    def getNodeStates(self, deadline=None):
+
         # get the system state from the API
-        systemState = self.controller.iaConn.getSystemState(self.serialNum) 
+        systemState = self.controller.iaConn.getSystemState(self.serialNum, deadline=deadline)
 
+        # get the devices state from the API only if the system state was retrieved
         if systemState:
+            devices = self.controller.iaConn.getDevicesList(self.serialNum, deadline=deadline)
+        else:
+            devices = {}
 
-            # Check that the system is online
-            if systemState["status"] not in ("Online", "Service"):
-                self.setDriver("ST", 0, True, forceReport)
-                mode = IX_SYS_OPMODE_UNKNOWN
-            else:
-                self.setDriver("ST", 1, True, forceReport)
-                if systemState["status"] == "Service":
-                    mode = IX_SYS_OPMODE_SERVICE
-                elif systemState[api.DEVICE_NAME_SPA] == api.DEVICE_STATE_ON:
-                    mode = IX_SYS_OPMODE_SPA
-                elif systemState[api.DEVICE_NAME_PUMP] == api.DEVICE_STATE_ON:
-                    mode = IX_SYS_OPMODE_POOL
-                else:
-                    mode = IX_SYS_OPMODE_OFF
-            
-            # update the drivers for the system node
-            self.setDriver("GV0", mode, True, forceReport)
-            
-            self.setDriver("CLITEMP", makeInt(systemState["air_temp"]), True, forceReport, uom=self.tempUOM)
-            self.setDriver("GV1", makeInt(systemState["freeze_protection"]), True, forceReport)
-            self.setDriver("GV11", makeInt(systemState["pool_salinity"]) * api.WATER_SALINITY_FACTOR, True, forceReport) 
-            self.setDriver("GV12", makeInt(systemState["ph"]) * api.WATER_PH_FACTOR, True, forceReport) 
-            self.setDriver("GV13", makeInt(systemState["orp"]) * api.WATER_ORP_FACTOR, True, forceReport) 
+        return (systemState, devices)
 
-            # get the devices state from the API
-            devices = self.controller.iaConn.getDevicesList(self.serialNum) 
+    # determine the system state attributes that changed since the last poll (None if there was no last poll)
+    def _diffSystemState(self, systemState):
 
-            # iterate through the nodes of the nodeserver
-            for addr in self.controller.nodes:
-        
-                # ignore the controller and this system node
-                if addr != self.address and addr != self.controller.address:
-
-                    # if the device belongs to this system (node's primary is this nodes address),
-                    # then update the state of the node's drivers
-                    node = self.controller.nodes[addr] 
-                    if node.primary == self.address:
-                       
-                        # Update drivers based on node type
-                        if node.deviceName in (api.DEVICE_NAME_PUMP, api.DEVICE_NAME_SPA, api.DEVICE_NAME_SOLAR_HEAT):
-                            node.setDriver("ST", translateState(systemState[node.deviceName]), True, forceReport)
-                        elif node.deviceName == api.DEVICE_NAME_POOL_HEAT:
-                            node.setDriver("ST", translateState(systemState[api.DEVICE_NAME_POOL_HEAT]), True, forceReport)
-                            node.setDriver("CLISPH", makeInt(systemState["pool_set_point"]), True, forceReport, uom=self.tempUOM)
-                            node.setDriver("CLITEMP", makeInt(systemState["pool_temp"]), True, forceReport, uom=self.tempUOM)
-                        elif node.deviceName == api.DEVICE_NAME_SPA_HEAT:
-                            node.setDriver("ST", translateState(systemState[api.DEVICE_NAME_SPA_HEAT]), True, forceReport)
-                            node.setDriver("CLISPH", makeInt(systemState["spa_set_point"]), True, forceReport, uom=self.tempUOM)
-                            node.setDriver("CLITEMP", makeInt(systemState["spa_temp"]), True, forceReport, uom=self.tempUOM)
-                        elif node.deviceName in devices:
-                            if node.id == "DIMMING_LIGHT":
-                                node.setDriver("ST", int(devices[node.deviceName]["subtype"]), True, forceReport)
-                            else:
-                                node.setDriver("ST", translateState(devices[node.deviceName]["state"]), True, forceReport)
-                        elif devices: # Don't change to UNKNOWN state unless device statuses were returned successfully but the node is not in the list
-                            node.setDriver("ST", IX_DEV_ST_UNKNOWN, True, forceReport)
-                        else:
-                            pass # Just leave the state alone if no device statuses were retrieved
+        if self._lastSystemState is None:
+            return None
+        else:
+            return {name for name, last, current in zip(systemState._fields, self._lastSystemState, systemState) if last != current}
+
+    # determine the devices (aux relays) whose state changed since the last poll (None if there was no last poll)
+    def _diffDevices(self, devices):
+
+        if self._lastDevices is None:
+            return None
+        else:
+            changed = {devID for devID, deviceState in devices.items() if self._lastDevices.get(devID) != deviceState}
+            changed.update(devID for devID in self._lastDevices if devID not in devices)
+            return changed
+
+    # determine whether the state of the system devices or aux relays changed since the last poll
+    def _stateChanged(self, systemState, devices, changedAttributes, changedDevices):
+
+        # compare the status and the states of the system devices
+        if changedAttributes and not changedAttributes.isdisjoint(SYSTEM_STATE_ATTRIBUTES):
+            return True
+
+        # compare the states of the aux relays, if they were retrieved
+        if devices and changedDevices:
+            for devID in changedDevices:
+                last = self._lastDevices.get(devID, {})
+                current = devices.get(devID, {})
+                if last.get("state") != current.get("state") or last.get("subtype") != current.get("subtype"):
+                    return True
+
+        return False
+
+    # update the state of all child nodes for this pool controller (system)
+    # Note: only the drivers of nodes with changed state attributes are updated, unless forceReport is specified
+    def updateNodeStates(self, forceReport=False, states=None):
+
+        # get the system and devices state from the API if not already retrieved
+        if states is None:
+            states = self.getNodeStates()
+        systemState, devices = states
+
+        if systemState:
+
+            # skip all driver processing if the API responses are unchanged since the last poll
+            # Note: the API returns the same state objects while the responses are unchanged
+            if not (forceReport or self._driversStale) and systemState is self._lastSystemState and (not devices or devices is self._lastDevices):
+                LOGGER.debug("State of system %s is unchanged.", self.name)
+
+            else:
+                self._updateDrivers(systemState, devices, forceReport)
+
+        # schedule the next poll of the system based on the result of this one
+        delay = self.pollScheduler.pollCompleted(bool(systemState), bool(systemState) and systemState["status"] == "Online")
+        LOGGER.debug("Next poll of system %s in %d seconds.", self.name, delay)
+
+    # update all of the drivers on the next poll, e.g., after a command has set drivers ahead of the API state
+    def setDriversStale(self):
+        self._driversStale = True
+
+    # update the drivers of the system node and the child nodes affected by changed state attributes
+    def _updateDrivers(self, systemState, devices, forceReport):
+
+        changedAttributes = self._diffSystemState(systemState)
+        changedDevices = self._diffDevices(devices) if devices else set()
+
+        # if the state of any device changed since the last poll (e.g., from the iAquaLink app
+        # or a schedule), then place the system in active polling mode
+        if self._stateChanged(systemState, devices, changedAttributes, changedDevices):
+            LOGGER.info("Device state change detected for system %s.", self.name)
+            self.pollScheduler.setActive()
+
+        # update all of the drivers if reporting is forced or the drivers may have been set ahead of the API state
+        # Note: the drivers stay stale until the device states were retrieved, since the aux relay nodes are not
+        # updated without them
+        if forceReport or self._driversStale:
+            changedAttributes = None
+            changedDevices = None
+            if devices:
+                self._driversStale = False
+
+        # save the state for comparison on the next poll (leave the last devices if they were not retrieved)
+        self._lastSystemState = systemState
+        if devices:
+            self._lastDevices = devices
+
+        # update the drivers for the system node, if any of its state attributes changed
+        if changedAttributes is None or not changedAttributes.isdisjoint(self.driverAttributes):
+            self.driverUpdater(systemState, forceReport)
+
+        # iterate through the child nodes indexed to this system
+        for node in self.controller.getChildNodes(self.address):
+
+            # update the system device nodes from the system state, if any of their state attributes changed
+            if node.driverAttributes is not None:
+                if changedAttributes is None or not changedAttributes.isdisjoint(node.driverAttributes):
+                    node.driverUpdater(systemState, forceReport)
+
+            # update the aux relay nodes from the state of the device, if it changed
+            elif changedDevices is None or node.deviceName in changedDevices:
+                if node.deviceName in devices:
+                    node.driverUpdater(devices[node.deviceName], forceReport)
+                elif devices: # Don't change to UNKNOWN state unless device statuses were returned successfully but the node is not in the list
+                    node.setDriver("ST", IX_DEV_ST_UNKNOWN, True, forceReport)
+                else:
+                    pass # Just leave the state alone if no device statuses were retrieved
 
     drivers = [
         {"driver": "ST", "value": 0, "uom": ISY_BOOL_UOM},
@@ -758,27 +1119,135 @@ class System(polyinterface.Node):
 class Controller(polyinterface.Controller):
 
     id = "CONTROLLER"
-    _customData = {}
+    _customData = None
     iaConn = None
-    _activePolling = False
-    _lastActive = 0  
+    _pollExecutor = None
+    minPollInterval = DEFAULT_SHORT_POLL
+    maxPollInterval = DEFAULT_LONG_POLL
+    _systemIndex = {}
+    _commandQueues = {}
+    coalesceWindow = DEFAULT_COALESCE_WINDOW
+    _breakerState = api.BREAKER_STATE_CLOSED
+    pollDeadline = DEFAULT_POLL_DEADLINE
+    lastPollDuration = 0
+    _lastMetricsTotals = None
+    _avgApiLatency = 0
+    _pollLock = None
+    serviceThread = None
+    _stopEvent = None
 
     def __init__(self, poly):
         super(Controller, self).__init__(poly)
         self.name = "iAquaLink Nodeserver"
 
-    # Set the active polling mode (short polling interval)
-    def setActiveMode(self):
-        self._activePolling = True
-        self._lastActive =  time.time()
+        # index of child nodes by system (primary) node address, maintained by addNode() and delNode()
+        self._systemIndex = {}
+
+        # command queues by system serial number, created with the first command for the system
+        self._commandQueues = {}
+
+        # lock to serialize the polls from shortPoll() and from the background startup
+        self._pollLock = threading.Lock()
+
+        # event for ending the background startup when the nodeserver is stopped
+        self._stopEvent = threading.Event()
+
+    # Add the node to the nodeserver and to the system -> child node index
+    def addNode(self, node, update=False):
+
+        node = super(Controller, self).addNode(node, update)
+
+        # compile the driver updater for the system or device node from its driver map
+        if node.address != self.address:
+            compileDriverUpdater(node)
+
+        # system nodes are their own primary
+        if node.address == node.primary:
+            if node.address != self.address:
+                self._systemIndex.setdefault(node.address, {})
+        
+        # otherwise index the node under its system node
+        else:
+            self._systemIndex.setdefault(node.primary, {})[node.address] = node
+
+        return node
+
+    # Delete the node from the nodeserver and from the system -> child node index
+    def delNode(self, address):
+
+        # remove the index for a system node or the index entry for a device node
+        self._systemIndex.pop(address, None)
+        for children in self._systemIndex.values():
+            children.pop(address, None)
+
+        # remove the instance variables of the node from custom data
+        if self._customData is not None:
+            self._customData.delete(address)
+
+        super(Controller, self).delNode(address)
+
+    # get the list of system nodes from the index
+    def getSystemNodes(self):
+        return [self.nodes[addr] for addr in list(self._systemIndex) if addr in self.nodes]
+
+    # get the list of child nodes for the specified system node from the index
+    def getChildNodes(self, systemAddr):
+        return list(self._systemIndex.get(systemAddr, {}).values())
+
+    # Set the active polling mode (short polling interval) for the system with the specified
+    # serial number, or for all systems if not specified
+    # Note: the drivers are also updated in full on the next poll since commands set drivers ahead of the API state
+    def setActiveMode(self, serialNum=None):
+        for node in self.getSystemNodes():
+            if serialNum is None or node.serialNum == serialNum:
+                node.pollScheduler.setActive()
+                node.setDriversStale()
+
+    # Queue a command for the system of the node and update the driver of the node ahead of the API call
+    # Note: if the API call fails, the driver is restored (unless changed by a later command) and in
+    # any case the drivers are reconciled with the API state on the next poll
+    def queueCommand(self, node, description, execute, driver, value, uom=None, key=None, args=None):
+
+        serialNum = node.parent.serialNum
+        priorValue = getDriverValue(node, driver)
+
+        # update the driver and place the system in active polling mode ahead of the API call
+        node.setDriver(driver, value, uom=uom)
+        self.setActiveMode(serialNum)
+
+        # reconcile the driver with the result of the API call
+        def complete(success):
+            if not success:
+                LOGGER.warning("%s command failed for %s.", description, node.name)
+                if getDriverValue(node, driver) == value:
+                    node.setDriver(driver, priorValue, uom=uom)
+            self.setActiveMode(serialNum)
+            self.setDriver("GV5", self.getQueuedCommands())
+
+        # add the command to the queue for the system
+        if serialNum not in self._commandQueues:
+            self._commandQueues[serialNum] = CommandQueue(serialNum, self.coalesceWindow)
+        self._commandQueues[serialNum].put(description, execute, complete, key, args)
+        self.setDriver("GV5", self.getQueuedCommands())
+
+    # get the number of commands waiting in the command queues for all systems
+    def getQueuedCommands(self):
+        return sum(commandQueue.pending() for commandQueue in list(self._commandQueues.values()))
 
     # Start the node server
+    # Note: the startup is staged so that start() does not wait on the iAquaLink service - the configuration
+    # is read, the nodes are restored (with the driver values kept by Polyglot), and then the login and the
+    # first poll run in the background
     def start(self):
 
         LOGGER.info("Started iAquaLink nodeserver...")
+        phaseStart = time.monotonic()
 
         # load custom data from polyglot
-        self._customData = self.polyConfig["customData"]
+        self._customData = CustomDataStore(self.polyConfig["customData"], self.saveCustomData)
+
+        # migrate custom data saved by earlier versions of the nodeserver to the current format
+        self.migrateCustomData()
         
         # If a logger level was stored for the controller, then use to set the logger level
         level = self.getCustomData("loggerlevel")
@@ -788,6 +1257,16 @@ class Controller(polyinterface.Controller):
         # remove all existing notices for the nodeserver
         self.removeNoticesAll()
 
+        # Set the nodeserver status flag to indicate nodeserver is running
+        self.setDriver("ST", 1, True, True)
+
+        # Report the logger level to the ISY
+        self.setDriver("GV20", LOGGER.level, True, True)
+
+        # the polling intervals adapt between shortPoll (after a command) and longPoll (idle)
+        self.minPollInterval = int(self.polyConfig.get("shortPoll", DEFAULT_SHORT_POLL))
+        self.maxPollInterval = int(self.polyConfig.get("longPoll", DEFAULT_LONG_POLL))
+
         # get iAquaLink service credentials from custom configuration parameters
         try:
             customParams = self.polyConfig["customParams"]
@@ -802,67 +1281,185 @@ class Controller(polyinterface.Controller):
         # get session TTL, if in the custom parameters 
         sessionTTL = int(customParams.get(PARAM_SESSION_TTL, DEFAULT_SESSION_TTL))
 
+        # get the maximum number of systems to poll concurrently, if in the custom parameters
+        maxPollThreads = max(int(customParams.get(PARAM_MAX_POLL_THREADS, DEFAULT_MAX_POLL_THREADS)), 1)
+
+        # create a bounded pool of worker threads for polling the systems
+        self._pollExecutor = ThreadPoolExecutor(max_workers=maxPollThreads, thread_name_prefix="iAquaPoll")
+
+        # get the maximum age of polled state that commands may use, if in the custom parameters
+        stateCacheAge = float(customParams.get(PARAM_STATE_CACHE_AGE, DEFAULT_STATE_CACHE_AGE))
+
+        # get the size of the HTTP connection pool for the session API, if in the custom parameters
+        httpPoolSize = max(int(customParams.get(PARAM_HTTP_POOL_SIZE, DEFAULT_HTTP_POOL_SIZE)), 1)
+
+        # get the window for merging bursts of light brightness and setpoint commands, if in the custom parameters
+        self.coalesceWindow = max(float(customParams.get(PARAM_COALESCE_WINDOW, DEFAULT_COALESCE_WINDOW)), 0)
+
+        # get the client-side rate limits for the API calls, if in the custom parameters (0 for no limit)
+        rateLimit = max(float(customParams.get(PARAM_RATE_LIMIT, DEFAULT_RATE_LIMIT)), 0)
+        systemRateLimit = max(float(customParams.get(PARAM_SYSTEM_RATE_LIMIT, DEFAULT_SYSTEM_RATE_LIMIT)), 0)
+
+        # get the bounds for the HTTP timeouts, if in the custom parameters (the maximum defaults to the fixed timeouts)
+        minHttpTimeout = max(float(customParams.get(PARAM_MIN_HTTP_TIMEOUT, DEFAULT_MIN_HTTP_TIMEOUT)), 0.1)
+        maxHttpTimeout = float(customParams[PARAM_MAX_HTTP_TIMEOUT]) if customParams.get(PARAM_MAX_HTTP_TIMEOUT) else None
+
+        # get the time allowed for retrieving the states of the systems in a poll, if in the custom parameters
+        self.pollDeadline = max(float(customParams.get(PARAM_POLL_DEADLINE, DEFAULT_POLL_DEADLINE)), 1)
+
+        # get whether slow state reads are hedged with a duplicate request, if in the custom parameters
+        hedgeReads = str(customParams.get(PARAM_HEDGE_READS, "false")).lower() in ("true", "1", "yes")
+
         # create a connection to the iAqualink cloud service
-        conn = api.iAqualinkConnection(sessionTTL=sessionTTL, logger=LOGGER)
+        conn = api.iAqualinkConnection(
+            sessionTTL=sessionTTL,
+            stateCacheAge=stateCacheAge,
+            poolSizes={api.API_SESSION_HOST: httpPoolSize},
+            apiHost=customParams.get(PARAM_API_HOST),
+            rateLimit=rateLimit,
+            serialRateLimit=systemRateLimit,
+            minTimeout=minHttpTimeout,
+            maxTimeout=maxHttpTimeout,
+            hedgeReads=hedgeReads,
+            logger=LOGGER
+        )
+
+        # open the HTTP connections to the API hosts in the background while restoring the nodes
+        self._pollExecutor.submit(conn.warmUpConnections)
+        phaseStart = logStartupPhase("configuration", phaseStart)
 
-        # login using the provided credentials
-        rc = conn.loginToService(userName, password)
-        if rc == api.LOGIN_BAD_AUTHENTICATION:
-            LOGGER.warning("Bad username or password specified.")
-            self.addNotice({"bad_auth": "Could not login to the iAquaLink service with the specified credentials. Please check the 'username' and 'password' parameter values in the Custom Configuration Parameters and restart the nodeserver."})
+        # load nodes previously saved to the polyglot database
+        self.restoreNodes()
+        logStartupPhase("node restore", phaseStart)
+
+        # update the controller node in Polyglot if it was saved without the current drivers (e.g., the
+        # performance drivers added in profile version 1.1)
+        savedNode = self._nodes.get(self.address)
+        if savedNode is not None and {d["driver"] for d in savedNode["drivers"]} != {d["driver"] for d in self.drivers}:
+            LOGGER.info("Updating the drivers of the controller node in Polyglot.")
+            self.updateNode(self)
+
+        # send the custom data changed at startup to polyglot, if any (e.g., the migrated custom data)
+        self._customData.save()
+
+        # login and poll in the background so that start() does not wait on the iAquaLink service
+        # Note: not on the polling worker threads since the poll waits on them
+        self.serviceThread = threading.Thread(target=self.connectService, args=(conn, userName, password), name="iAquaStartup", daemon=True)
+        self.serviceThread.start()
+
+    # Migrate the custom data saved by earlier versions of the nodeserver to the current format and stamp
+    # the current version (see CUSTOM_DATA_VERSION)
+    def migrateCustomData(self):
+
+        version = self._customData.get(CUSTOM_DATA_VERSION_KEY, 1)
+        if version == CUSTOM_DATA_VERSION:
             return
-        elif rc == api.LOGIN_ERROR:
-            self.addNotice({"login_error":"There was an error connecting to the iAquaLink service. Please check the log files and correct the issue before restarting the nodeserver."})
-            LOGGER.error("Error logging into iAquaLink service.")
+
+        # leave custom data saved by a later version alone
+        if version > CUSTOM_DATA_VERSION:
+            LOGGER.warning("Custom data was saved by a later version of the nodeserver (format version %d).", version)
             return
 
-        # load nodes previously saved to the polyglot database
-        # Note: has to be done in two passes to ensure system (primary/parent) nodes exist
-        # before device nodes
-        # first pass for system nodes
-        for addr in self._nodes:           
-            node = self._nodes[addr]
-            if node[NODE_DEF_ID_KEY] == "SYSTEM":
-                
-                LOGGER.info("Adding previously saved node - addr: %s, name: %s, type: %s", addr, node["name"], node[NODE_DEF_ID_KEY])
-                self.addNode(System(self, node["primary"], addr, node["name"]))
+        LOGGER.info("Migrating custom data from format version %d to %d.", version, CUSTOM_DATA_VERSION)
+
+        # add the (empty) topology fingerprint to the system entries - the topology is rebuilt by the next discovery
+        if version < 2:
+            for addr, node in self._nodes.items():
+                cData = self._customData.get(addr)
+                if node[NODE_DEF_ID_KEY] == "SYSTEM" and cData is not None and cData.count(";") == 2:
+                    self._customData.set(addr, cData + ";")
+
+        # remove the snapshot of driver values - Polyglot restores the last reported values of the nodes
+        if version < 3:
+            self._customData.delete(SNAPSHOT_CUSTOM_DATA_KEY)
 
-        # second pass for device nodes
-        for addr in self._nodes:         
-            node = self._nodes[addr]    
-            if node[NODE_DEF_ID_KEY] not in ("CONTROLLER", "SYSTEM"):
+        self._customData.set(CUSTOM_DATA_VERSION_KEY, CUSTOM_DATA_VERSION)
+
+    # Restore the nodes previously saved to the polyglot database in a single pass, with the system
+    # (primary/parent) nodes ahead of the device nodes that depend on them
+    def restoreNodes(self):
+
+        nodeClasses = {
+            "SYSTEM": System,
+            "DEVICE": Device,
+            "DIMMING_LIGHT": DimmingLight,
+            "TEMP_CONTROL": TempControl,
+            "TEMP_CONTROL_C": TempControl,
+        }
+        nodeClasses.update({nodeDefID: ColorLight for nodeDefID in DEVICE_COLOR_LIGHT_TYPES.values()})
+
+        for addr, node in sorted(self._nodes.items(), key=lambda item: item[1][NODE_DEF_ID_KEY] != "SYSTEM"):
+            nodeClass = nodeClasses.get(node[NODE_DEF_ID_KEY])
+            if nodeClass is not None:
 
                 LOGGER.info("Adding previously saved node - addr: %s, name: %s, type: %s", addr, node["name"], node[NODE_DEF_ID_KEY])
+                self.addNode(nodeClass(self, node["primary"], addr, node["name"]))
 
-                # add device and temperature controller nodes
-                if node[NODE_DEF_ID_KEY] == "DEVICE":
-                    self.addNode(Device(self, node["primary"], addr, node["name"]))
-                elif node[NODE_DEF_ID_KEY] == "DIMMING_LIGHT":
-                    self.addNode(DimmingLight(self, node["primary"], addr, node["name"]))
-                elif node[NODE_DEF_ID_KEY] in DEVICE_COLOR_LIGHT_TYPES.values():
-                    self.addNode(ColorLight(self, node["primary"], addr, node["name"]))
-                elif node[NODE_DEF_ID_KEY] in ("TEMP_CONTROL", "TEMP_CONTROL_C"):
-                    self.addNode(TempControl(self, node["primary"], addr, node["name"]))
-
-        # set the object level connection variable
-        self.iaConn = conn
+    # Login to the iAquaLink service and poll the states of all nodes, reporting all of the driver values
+    # Note: a failed login is retried on the STARTUP_RETRY_DELAYS schedule until the nodeserver is stopped
+    def connectService(self, conn, userName, password):
 
-        # Set the nodeserver status flag to indicate nodeserver is running
-        self.setDriver("ST", 1, True, True)
+        phaseStart = time.monotonic()
 
-        # Report the logger level to the ISY
-        self.setDriver("GV20", LOGGER.level, True, True)
- 
-        # update the driver values of all nodes (force report)
+        # login using the provided credentials
+        attempt = 0
+        while True:
+            rc = conn.loginToService(userName, password)
+            if rc == api.LOGIN_SUCCESS:
+                break
+            elif rc == api.LOGIN_BAD_AUTHENTICATION:
+                LOGGER.warning("Bad username or password specified.")
+                self.addNotice({"bad_auth": "Could not login to the iAquaLink service with the specified credentials. Please check the 'username' and 'password' parameter values in the Custom Configuration Parameters and restart the nodeserver."})
+                conn.close()
+                return
+
+            # retry the login after the delay for the attempt
+            delay = STARTUP_RETRY_DELAYS[min(attempt, len(STARTUP_RETRY_DELAYS) - 1)]
+            attempt += 1
+            LOGGER.error("Error logging into iAquaLink service (attempt %d) - retrying in %d seconds.", attempt, delay)
+            if attempt == 1:
+                self.addNotice({"login_error":"There was an error connecting to the iAquaLink service. The nodeserver will keep retrying - please check the log files if the error persists."})
+            if self._stopEvent.wait(delay):
+                conn.close()
+                return
+
+        if attempt:
+            self.removeNotice("login_error")
+        phaseStart = logStartupPhase("login", phaseStart)
+
+        # set the object level connection variable, unless the nodeserver was stopped during the login
+        if self._stopEvent.is_set():
+            conn.close()
+            return
+        self.iaConn = conn
+
+        # update the driver values of all nodes, reporting all of the values so that the ISY is brought
+        # in line with the iAquaLink service after the restart
         self.updateNodeStates(True)
+        logStartupPhase("first poll", phaseStart)
 
         # startup in active mode polling
         self.setActiveMode()
 
     # shutdown the nodeserver on stop
     def stop(self):
+
+        # end the background startup, if still running
+        self._stopEvent.set()
+
+        # close the connection and save any pending changes to the custom data
         if self.iaConn is not None:
             self.iaConn.close()
+        if self._customData is not None:
+            self._customData.flush()
+
+        # shutdown the polling worker threads
+        if self._pollExecutor is not None:
+            self._pollExecutor.shutdown(wait=False)
+
+        # stop the command queue worker threads
+        for commandQueue in self._commandQueues.values():
+            commandQueue.stop()
 
         # Set the nodeserver status flag to indicate nodeserver is not running
         self.setDriver("ST", 0, True, True)
@@ -896,62 +1493,66 @@ class Controller(polyinterface.Controller):
 
         # store the new loger level in custom data
         self.addCustomData("loggerlevel", value)
-        self.saveCustomData(self._customData)
+        self._customData.save()
         
         # update the state driver to the level set
         self.setDriver("GV20", value)
 
-    # called every longPoll seconds (default 30)
-    def longPoll(self):
-
-        # only run if iAquaLink connection is established
-        if self.iaConn is not None:
-            
-            # if not in active polling mode, then update the node states
-            if not self._activePolling:
-                LOGGER.info("Updating node states in longPoll()...")
-                self.updateNodeStates()          
-
-    # called every shortPoll seconds (default 10)
+    # called every shortPoll seconds (default 15)
     def shortPoll(self):
 
         # only run if iAquaLink connection is established
         if self.iaConn is not None:
             
-            # if in active polling mode, then update the node states
-            if self._activePolling:
-                LOGGER.info("Updating node states in shortPoll()...")
-                self.updateNodeStates()          
-
-            # reset active flag if 5 minutes has passed
-            if self._lastActive < (time.time() - 300):
-                self._activePolling = False
+            # update the node states for the systems that are due to be polled
+            self.updateNodeStates(dueOnly=True)
 
     # discover systems and associated devices for iAquaLink account
     def discover(self):
 
-        # retrieve a list of systems (pool controllers) from the user profile
-        systems = self.iaConn.getSystemsList()
+        # hold the poll lock so that polls do not run while the system and device nodes are being added and retired
+        with self._pollLock:
 
-        for system in systems:
+            # retrieve a list of systems (pool controllers) from the user profile
+            systems = self.iaConn.getSystemsList()
+            if systems is False:
+                LOGGER.warning("Could not retrieve the systems list from the iAquaLink service in discover().")
+                self.addNotice({"discover_error": "Could not retrieve the list of systems from the iAquaLink service. Please try the discovery again later."})
+                return
+            self.removeNotice("discover_error")
 
-            # check to see if a node already exists for the system
-            systemAddr = getValidNodeAddress(str(system["id"]))
-            if systemAddr not in self.nodes:
+            nodes = []
+            for system in systems:
 
-                # create a node for the system
-                node = System(self, self.address, systemAddr, getValidNodeName(system["name"]), system["serial_number"])
-                self.addNode(node)
+                # check to see if a node already exists for the system
+                systemAddr = getValidNodeAddress(str(system["id"]))
+                if systemAddr not in self.nodes:
+
+                    # create a node for the system
+                    node = System(self, self.address, systemAddr, getValidNodeName(system["name"]), system["serial_number"])
+                    self.addNode(node)
                 
-            else:
-                node = self.nodes[systemAddr]
+                else:
+                    node = self.nodes[systemAddr]
+
+                nodes.append(node)
+
+            # retrieve the states for all of the systems in parallel using the polling worker threads
+            futures = [self._pollExecutor.submit(node.getNodeStates) for node in nodes]
+
+            # perform device discovery for each system (pool controller) on this thread, in system order
+            for node, future in zip(nodes, futures):
+                try:
+                    states = future.result()
+                except Exception as e:
+                    LOGGER.error("Error retrieving node states for system %s: %s", node.name, str(e))
+                    states = (None, {})
 
-            # perform device discovery for the system (pool controller)
-            if not node.discoverDevices():
-                self.addNotice(f"Could not discover devices for system {node.name}. The pool controller may be offline or in service mode.")
+                if not node.discoverDevices(states):
+                    self.addNotice(f"Could not discover devices for system {node.name}. The pool controller may be offline or in service mode.")
 
-        # send custom data added by new nodes to polyglot
-        self.saveCustomData(self._customData)
+            # send custom data added or changed by the discovery to polyglot, if any
+            self._customData.save()
 
         # update the driver values for the discovered systems and devices (force report)
         # Note: It appears that the messaging for the initial updates for newly created nodes either don't make it to 
@@ -962,29 +1563,107 @@ class Controller(polyinterface.Controller):
         # Place the controller in active polling mode
         self.setActiveMode()
 
-    # update the node states for all system and device nodes
-    def updateNodeStates(self, forceReport=False):
+    # update the node states for all system and device nodes, or only for systems due to be polled,
+    # and then update the performance drivers of the controller node
+    def updateNodeStates(self, forceReport=False, dueOnly=False):
+
+        with self._pollLock:
+            start = time.monotonic()
+            if self.pollSystems(forceReport, dueOnly):
+                self.lastPollDuration = time.monotonic() - start
+
+        self.updatePerformanceDrivers(forceReport)
+
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("%s", self.iaConn.dumpMetrics())
+
+    # poll the iAquaLink service for the states of all systems, or only for systems due to be polled, and
+    # update the drivers of the nodes for each system - returns True if a poll was made
+    def pollSystems(self, forceReport=False, dueOnly=False):
 
-        LOGGER.debug("Polling iAquaLink service for node states in updateNodeState()...")
-        
         self._lastPoll = time.time()
         
-        # iterate through the nodes of the nodeserver
-        for addr in self.nodes:
-        
-            # ignore the controller node
-            if addr != self.address:
+        # get the list of system nodes from the index, filtering for the polling schedule if specified
+        systems = [node for node in self.getSystemNodes() if not dueOnly or node.pollScheduler.isDue(self._lastPoll)]
+        if not systems:
+            return False
+
+        # skip polling while the iAquaLink service is down (circuit breaker open), and poll only a single
+        # system to probe the service when the breaker is half-open
+        breakerState = self.iaConn.getBreakerState()
+        if breakerState == api.BREAKER_STATE_OPEN:
+            LOGGER.info("iAquaLink service unavailable - skipping poll of %d system(s).", len(systems))
+            self._breakerState = breakerState
+            return False
+        elif breakerState == api.BREAKER_STATE_HALF_OPEN:
+            systems = systems[:1]
+
+        LOGGER.info("Polling iAquaLink service for node states of %d system(s) in pollSystems()...", len(systems))
+
+        # retrieve the states for all of the systems in parallel using the polling worker threads
+        # Note: the API calls are shortened or skipped to meet the deadline for the poll
+        # Note: the states retrieved by a recent discovery are used instead of retrieving them again
+        deadline = time.monotonic() + self.pollDeadline
+        futures = []
+        for node in systems:
+            states = node.takeDiscoveredStates()
+            if states is not None:
+                future = Future()
+                future.set_result(states)
+            else:
+                future = self._pollExecutor.submit(node.getNodeStates, deadline)
+            futures.append(future)
+
+        # update the drivers of the nodes for each system on this thread, in system order, as
+        # the states become available
+        for node, future in zip(systems, futures):
+            try:
+                states = future.result()
+            except Exception as e:
+                LOGGER.error("Error retrieving node states for system %s: %s", node.name, str(e))
+                node.pollScheduler.pollCompleted(False)
+                continue
+
+            node.updateNodeStates(forceReport, states)
+
+        # when the service becomes available again, place all systems in active polling mode to resync the states
+        breakerState = self.iaConn.getBreakerState()
+        if breakerState == api.BREAKER_STATE_CLOSED and self._breakerState != api.BREAKER_STATE_CLOSED:
+            LOGGER.info("iAquaLink service available - resuming polling of all systems.")
+            self.setActiveMode()
+        self._breakerState = breakerState
+
+        return True
+
+    # update the performance drivers of the controller node: last poll duration, average API latency, API errors
+    # in the last hour, current polling interval, and commands waiting in the queues
+    # Note: the average API latency is for the requests sent since the last update (unchanged if none were sent)
+    def updatePerformanceDrivers(self, forceReport=False):
+
+        totals = self.iaConn.getMetricsTotals()
+        lastTotals = self._lastMetricsTotals
+        if lastTotals is None:
+            sent, totalTime = totals["sent"], totals["totalTime"]
+        else:
+            sent, totalTime = totals["sent"] - lastTotals["sent"], totals["totalTime"] - lastTotals["totalTime"]
+        if sent:
+            self._avgApiLatency = totalTime / sent
+        self._lastMetricsTotals = totals
+
+        # the current polling interval is the shortest of the intervals for the systems
+        pollIntervals = [node.pollScheduler.delay for node in self.getSystemNodes()]
 
-                # if the device is a system node, call the updateNodeStates method
-                node = self.controller.nodes[addr]
-                if node.id == "SYSTEM":
-                    node.updateNodeStates(forceReport)
+        self.setDriver("GV1", int(round(self.lastPollDuration * 1000)), True, forceReport)
+        self.setDriver("GV2", int(round(self._avgApiLatency * 1000)), True, forceReport)
+        self.setDriver("GV3", totals["recentErrors"], True, forceReport)
+        self.setDriver("GV4", int(round(min(pollIntervals))) if pollIntervals else 0, True, forceReport)
+        self.setDriver("GV5", self.getQueuedCommands(), True, forceReport)
 
     # helper method for storing custom data
     def addCustomData(self, key, data):
 
         # add specififed data to custom data for specified key
-        self._customData.update({key: data})
+        self._customData.set(key, data)
 
     # helper method for retrieve custom data
     def getCustomData(self, key):
@@ -994,6 +1673,11 @@ class Controller(polyinterface.Controller):
         
     drivers = [
         {"driver": "ST", "value": 0, "uom": ISY_BOOL_UOM},
+        {"driver": "GV1", "value": 0, "uom": ISY_MS_UOM},
+        {"driver": "GV2", "value": 0, "uom": ISY_MS_UOM},
+        {"driver": "GV3", "value": 0, "uom": ISY_RAW_UOM},
+        {"driver": "GV4", "value": 0, "uom": ISY_SECONDS_UOM},
+        {"driver": "GV5", "value": 0, "uom": ISY_RAW_UOM},
         {"driver": "GV20", "value": 0, "uom": ISY_INDEX_UOM}
     ]
     commands = {
@@ -1002,6 +1686,13 @@ class Controller(polyinterface.Controller):
         "SET_LOGLEVEL": cmd_setLogLevel
     }
 
+# Log the duration of a startup phase and return the start time for the next phase
+def logStartupPhase(phase, phaseStart):
+
+    now = time.monotonic()
+    LOGGER.info("Startup phase %s completed in %.3f seconds.", phase, now - phaseStart)
+    return now
+
 # Removes invalid charaters and lowercase ISY Node address
 def getValidNodeAddress(s):
 
@@ -1016,6 +1707,15 @@ def getValidNodeName(s):
     # remove <>`~!@#$%^&*(){}[]?/\;:"' characters from names
     return re.sub(r"[<>`~!@#$%^&*(){}[\]?/\\;:\"']+", "", s)
 
+# Get the local value of a node driver
+# Note: unlike Node.getDriver(), this includes driver updates not yet reflected in the Polyglot config
+def getDriverValue(node, driver):
+
+    for d in node.drivers:
+        if d["driver"] == driver:
+            return d["value"]
+    return None
+
 # Convert possibly empty string to int
 def makeInt(s):
 
@@ -1026,6 +1726,114 @@ def translateState(s):
 
     return int(s) if s else IX_DEV_ST_UNKNOWN
 
+# Get the ST driver value for the status of the system
+def systemOnline(status):
+
+    return 1 if status in ("Online", "Service") else 0
+
+# Get the operating mode for the status, spa, and pump state of the system
+def systemMode(state):
+
+    status, spa, pump = state
+    if status not in ("Online", "Service"):
+        return IX_SYS_OPMODE_UNKNOWN
+    elif status == "Service":
+        return IX_SYS_OPMODE_SERVICE
+    elif spa == api.DEVICE_STATE_ON:
+        return IX_SYS_OPMODE_SPA
+    elif pump == api.DEVICE_STATE_ON:
+        return IX_SYS_OPMODE_POOL
+    else:
+        return IX_SYS_OPMODE_OFF
+
+# Get a function that converts a possibly empty string to an int scaled by the factor
+def makeScaledInt(factor):
+
+    return lambda s: makeInt(s) * factor
+
+# driver maps: (driver, state attributes, transform, UOM) for each driver of a node type, where the transform
+# takes the value of the state attribute (or a tuple of the values for multiple attributes) and the UOM is
+# None for the UOM of the driver definition or UOM_SYSTEM_TEMP for the temperature UOM of the system
+# Note: the driver maps are compiled into a driver updater function for each node (see compileDriverUpdater)
+
+# drivers of the system node from the system state
+SYSTEM_DRIVER_MAP = (
+    ("ST", ("status",), systemOnline, None),
+    ("GV0", ("status", api.DEVICE_NAME_SPA, api.DEVICE_NAME_PUMP), systemMode, None),
+    ("CLITEMP", ("air_temp",), makeInt, UOM_SYSTEM_TEMP),
+    ("GV1", ("freeze_protection",), makeInt, None),
+    ("GV11", ("pool_salinity",), makeScaledInt(api.WATER_SALINITY_FACTOR), None),
+    ("GV12", ("ph",), makeScaledInt(api.WATER_PH_FACTOR), None),
+    ("GV13", ("orp",), makeScaledInt(api.WATER_ORP_FACTOR), None),
+)
+
+# drivers of the system device nodes from the system state, by device name
+SYSTEM_DEVICE_DRIVER_MAPS = {
+    api.DEVICE_NAME_PUMP: (
+        ("ST", (api.DEVICE_NAME_PUMP,), translateState, None),
+    ),
+    api.DEVICE_NAME_SPA: (
+        ("ST", (api.DEVICE_NAME_SPA,), translateState, None),
+    ),
+    api.DEVICE_NAME_SOLAR_HEAT: (
+        ("ST", (api.DEVICE_NAME_SOLAR_HEAT,), translateState, None),
+    ),
+    api.DEVICE_NAME_POOL_HEAT: (
+        ("ST", (api.DEVICE_NAME_POOL_HEAT,), translateState, None),
+        ("CLISPH", ("pool_set_point",), makeInt, UOM_SYSTEM_TEMP),
+        ("CLITEMP", ("pool_temp",), makeInt, UOM_SYSTEM_TEMP),
+    ),
+    api.DEVICE_NAME_SPA_HEAT: (
+        ("ST", (api.DEVICE_NAME_SPA_HEAT,), translateState, None),
+        ("CLISPH", ("spa_set_point",), makeInt, UOM_SYSTEM_TEMP),
+        ("CLITEMP", ("spa_temp",), makeInt, UOM_SYSTEM_TEMP),
+    ),
+}
+
+# drivers of the aux relay nodes from the state of the device, by node def ID (default for the others)
+AUX_DRIVER_MAPS = {
+    "DIMMING_LIGHT": (
+        ("ST", ("subtype",), int, None),
+    ),
+}
+AUX_DEFAULT_DRIVER_MAP = (
+    ("ST", ("state",), translateState, None),
+)
+
+# Compile the driver map for the node into a function that updates the drivers of the node from the state
+# data (system state or device state) in a flat loop, and set the state attributes of the system state the
+# drivers depend on (None for aux relay nodes, which depend on the state of the device)
+# Note: the attribute extractors and the UOMs are resolved here, once for each node
+def compileDriverUpdater(node):
+
+    if isinstance(node, System):
+        driverMap = SYSTEM_DRIVER_MAP
+        tempUOM = node.tempUOM
+        fromSystemState = True
+    elif node.deviceName in SYSTEM_DEVICE_DRIVER_MAPS:
+        driverMap = SYSTEM_DEVICE_DRIVER_MAPS[node.deviceName]
+        tempUOM = node.parent.tempUOM
+        fromSystemState = True
+    else:
+        driverMap = AUX_DRIVER_MAPS.get(node.id, AUX_DEFAULT_DRIVER_MAP)
+        tempUOM = None
+        fromSystemState = False
+
+    extractors = tuple(
+        (driver, itemgetter(*attributes), transform, tempUOM if uom == UOM_SYSTEM_TEMP else uom)
+        for driver, attributes, transform, uom in driverMap
+    )
+
+    def driverUpdater(state, force=False):
+        for driver, extract, transform, uom in extractors:
+            node.setDriver(driver, transform(extract(state)), True, force, uom)
+
+    node.driverUpdater = driverUpdater
+    if fromSystemState:
+        node.driverAttributes = frozenset(attr for entry in driverMap for attr in entry[1])
+    else:
+        node.driverAttributes = None
+
 # Main function to establish Polyglot connection
 if __name__ == "__main__":
     try:
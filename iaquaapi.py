@@ -7,7 +7,19 @@ by Goose66 (W. Randy King) kingwrandy@gmail.com
 import sys
 import logging 
 import requests
+import urllib3
 import time
+import random
+import threading
+import zlib
+import concurrent.futures
+import json
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
+from operator import itemgetter
+from math import ceil
+from urllib.parse import urlsplit
 
 # Configure a module level logger for module testing
 _LOGGER = logging.getLogger(__name__)
@@ -32,6 +44,9 @@ _API_SESSION = {
     "method": "GET"
 }
 
+# Host for the session API (used for sizing the connection pools)
+API_SESSION_HOST = urlsplit(_API_SESSION["url"]).netloc
+
 # Device names for system level devices (other than aux_n)
 DEVICE_NAME_PUMP = "pool_pump"
 DEVICE_NAME_SPA = "spa_pump"
@@ -82,6 +97,605 @@ _HTTP_POST_TIMEOUT = 4.05
 # default session TTL
 _DEFAULT_SESSION_TTL = 3600  # 1 hour
 
+# timing for refreshing the session in the background ahead of the TTL expiring
+_SESSION_REFRESH_MARGIN = 300 # seconds before the TTL expires
+_SESSION_REFRESH_RETRY = 60 # seconds between retries of a failed refresh
+
+# default maximum age of cached state data accepted by getDeviceState()
+_DEFAULT_STATE_CACHE_AGE = 10 # seconds
+
+# default maximum number of keep-alive connections pooled for each API host
+_DEFAULT_POOL_SIZES = {
+    urlsplit(_API_LOGIN["url"]).netloc: 2,
+    urlsplit(_API_SYSTEMS["url"]).netloc: 2,
+    API_SESSION_HOST: 10,
+}
+
+# default client-side rate limits for the API calls (0 for no limit)
+_DEFAULT_RATE_LIMIT = 10.0 # requests per second for all API calls
+_DEFAULT_SERIAL_RATE_LIMIT = 2.0 # requests per second for the API calls for each system
+_RATE_LIMIT_BURST = 2 # seconds of requests that may be sent in a burst
+
+# adaptive HTTP timeouts derived from the observed latencies, bounded by the floor and the ceiling
+# Note: the ceilings are the fixed timeouts (_HTTP_GET_TIMEOUT and _HTTP_POST_TIMEOUT) by default
+_DEFAULT_MIN_TIMEOUT = 1.0 # seconds
+_TIMEOUT_LATENCY_FACTOR = 3 # multiple of the p99 latency
+_LATENCY_WINDOW = 100 # latencies kept for each endpoint and command
+_LATENCY_MIN_SAMPLES = 20 # latencies required before the timeouts adapt
+_CONNECT_MIN_SAMPLES = 5 # connect latencies required before the connect timeouts adapt (connects are rare)
+
+# hedging of state reads - a duplicate request is sent if the first has not responded by the p95 latency
+_HEDGE_BUDGET = 0.1 # maximum hedge requests as a fraction of the reads sent
+_HEDGE_BURST = 1 # hedge requests allowed in addition to the budget
+_HEDGE_MAX_WORKERS = 16 # threads for sending the hedged requests
+
+# retry policy for idempotent API calls (state reads and the systems list)
+_RETRY_ATTEMPTS = 3 # total attempts
+_RETRY_BASE_DELAY = 0.5 # seconds - the backoff is a random delay up to base * 2^(attempt - 1)
+_RETRY_MAX_DELAY = 4.0 # seconds
+
+# upper bounds (seconds) of the latency histogram buckets - latencies above the last bound are counted in an overflow bucket
+_METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# period for counting the recent errors, kept in one minute buckets
+_METRICS_ERROR_PERIOD = 3600 # seconds
+
+# error types counted by the instrumentation (HTTP errors are counted as "http_<status code>")
+METRICS_ERROR_TIMEOUT = "timeout"
+METRICS_ERROR_CONNECTION = "connection"
+METRICS_ERROR_UNEXPECTED = "unexpected"
+METRICS_ERROR_CIRCUIT_OPEN = "circuit_open" # call skipped while the circuit breaker is open
+METRICS_ERROR_DEADLINE = "deadline" # call skipped because the deadline had passed
+
+# error types that are not failures of the service - counted by type but not in the error totals and rate
+_METRICS_SKIP_ERRORS = (METRICS_ERROR_DEADLINE,)
+
+# metrics dump formats
+METRICS_FORMAT_TEXT = "text"
+METRICS_FORMAT_JSON = "json"
+
+# circuit breaker states
+BREAKER_STATE_CLOSED = "closed" # service is available - calls are made
+BREAKER_STATE_OPEN = "open" # service is down - calls fail fast
+BREAKER_STATE_HALF_OPEN = "half-open" # service is being probed with a single call
+
+# circuit breaker settings
+_BREAKER_FAILURE_THRESHOLD = 5 # consecutive failed calls to open the breaker
+_BREAKER_RESET_TIMEOUT = 30 # seconds the breaker stays open before probing the service
+_BREAKER_MAX_RESET_TIMEOUT = 300 # seconds - the reset timeout doubles with each failed probe
+
+# home screen attributes kept in the system state
+_SYSTEM_STATE_FIELDS = (
+    "status",
+    "response",
+    "system_type",
+    "temp_scale",
+    "spa_temp",
+    "pool_temp",
+    "air_temp",
+    "spa_set_point",
+    "pool_set_point",
+    "cover_pool",
+    "spa_pump",
+    "pool_pump",
+    "spa_heater",
+    "pool_heater",
+    "solar_heater",
+    "spa_salinity",
+    "pool_salinity",
+    "orp",
+    "ph",
+    "freeze_protection",
+)
+
+# Base class for compact, immutable state records built from the response data in a single pass
+# The records allow read-only dictionary style access (record["status"]) as well as attribute access
+# (record.status). Attributes not present in the response data are "".
+class _StateRecord(tuple):
+
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+    _empty = ()
+    _layouts = {}
+
+    # setup the field index and an attribute property for each field of the record class
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+        cls._empty = ("",) * len(cls._fields)
+        cls._layouts = {}
+        for i, name in enumerate(cls._fields):
+            setattr(cls, name, property(lambda self, i=i: tuple.__getitem__(self, i)))
+
+    # create the record from the field values (in field order)
+    def __new__(cls, values):
+        return tuple.__new__(cls, values)
+
+    # copy and pickle the record by its field values
+    def __getnewargs__(self):
+        return (tuple(self),)
+
+    # build the record from a list of single entry attribute dictionaries, filling the fields directly
+    # from the response data with no intermediate dictionary
+    # Note: the positions of the fields in the list are learned from the response data for each layout key
+    # (e.g., the serial number of the system), and responses with the same layout are read with one C level
+    # lookup per field that also verifies the attribute name
+    @classmethod
+    def fromAttributes(cls, attrs, layoutKey=None):
+
+        layout = cls._layouts.get(layoutKey)
+        if layout is not None:
+            try:
+                return tuple.__new__(cls, map(dict.__getitem__, layout(attrs), cls._fields))
+
+            # the layout of the response changed - read the fields by name below
+            except (KeyError, IndexError, TypeError):
+                pass
+
+        # fill the fields by attribute name in a single pass, recording their positions
+        values = list(cls._empty)
+        positions = [None] * len(values)
+        index = cls._index
+        for position, attr in enumerate(attrs):
+            for key in attr:
+                i = index.get(key)
+                if i is not None:
+                    values[i] = attr[key]
+                    positions[i] = position
+
+        # keep the layout for the next response with the same key if all of the fields were present
+        if None not in positions:
+            cls._layouts[layoutKey] = itemgetter(*positions)
+
+        return tuple.__new__(cls, values)
+
+    def __getitem__(self, key):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except (KeyError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in zip(self._fields, self)))
+
+# State of a system (pool controller) from the home screen response data
+class SystemState(_StateRecord):
+
+    __slots__ = ()
+    _fields = _SYSTEM_STATE_FIELDS
+
+
+# Determine whether a request exception indicates a failure of the service (timeouts, connection errors,
+# server errors, and throttling) rather than a problem with the request
+def _isServiceFailure(e):
+
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is None or e.response.status_code >= 500 or e.response.status_code == 429
+    else:
+        return True
+
+# Get the error type counted by the instrumentation for an exception raised by an API call
+def _errorType(e):
+
+    if isinstance(e, requests.exceptions.Timeout):
+        return METRICS_ERROR_TIMEOUT
+    elif isinstance(e, requests.exceptions.ConnectionError):
+        return METRICS_ERROR_CONNECTION
+    elif isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return "http_%d" % e.response.status_code
+    else:
+        return METRICS_ERROR_UNEXPECTED
+
+# Get the key for the latencies of an API call - the endpoint and the command, if any, without aux numbers
+def _latencyKey(api, command):
+
+    endpoint = urlsplit(api["url"]).path.rsplit("/", 1)[-1]
+    return endpoint + " " + command.rstrip("0123456789") if command else endpoint
+
+# Close the response of an abandoned request (the loser of a hedged request)
+def _discardResponse(future):
+
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        future.result().close()
+
+# Token bucket for limiting the rate of requests
+class _TokenBucket(object):
+
+    rate = 0.0
+    burst = 1.0
+    tokens = 1.0
+    updated = 0.0
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.burst = max(rate * _RATE_LIMIT_BURST, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    # add the tokens for the time elapsed and return the delay (seconds) until a token is available
+    def delay(self, now):
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1.0
+
+# Client-side rate limiter for the API calls with a token bucket for all calls and one for each system
+# Note: reads (polling) yield to commands waiting for a token
+class _RateLimiter(object):
+
+    _condition = None
+    _globalBucket = None
+    _serialRate = 0.0
+    _serialBuckets = None
+    _commandsWaiting = 0
+    _stats = None
+
+    def __init__(self, rate, serialRate):
+        self._condition = threading.Condition()
+        self._globalBucket = _TokenBucket(rate)
+        self._serialRate = serialRate
+        self._serialBuckets = {}
+        self._stats = {
+            "read": {"requests": 0, "delayed": 0, "totalWait": 0.0, "maxWait": 0.0},
+            "command": {"requests": 0, "delayed": 0, "totalWait": 0.0, "maxWait": 0.0},
+        }
+
+    # wait for a token for a request, for the specified system if any, and return the time waited (seconds)
+    # Note: if a deadline (time.monotonic() value) is specified, the wait ends at the deadline and None is
+    # returned if no token was taken
+    def acquire(self, serialNum=None, command=False, deadline=None):
+
+        start = time.monotonic()
+        with self._condition:
+            if command:
+                self._commandsWaiting += 1
+            try:
+                while True:
+
+                    # determine the delay until a token is available from both the buckets
+                    now = time.monotonic()
+                    delay = self._globalBucket.delay(now)
+                    serialBucket = None
+                    if serialNum is not None and self._serialRate:
+                        serialBucket = self._serialBuckets.get(serialNum)
+                        if serialBucket is None:
+                            serialBucket = self._serialBuckets[serialNum] = _TokenBucket(self._serialRate)
+                        delay = max(delay, serialBucket.delay(now))
+
+                    # take the tokens if available, unless this is a read and commands are waiting
+                    if delay <= 0 and (command or not self._commandsWaiting):
+                        self._globalBucket.take()
+                        if serialBucket is not None:
+                            serialBucket.take()
+                        break
+
+                    # give up if a token will not be available before the deadline
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or delay >= remaining:
+                            return None
+                        self._condition.wait(delay if delay > 0 else remaining)
+                    else:
+                        self._condition.wait(delay if delay > 0 else None)
+
+            # let any reads yielding to this command continue
+            finally:
+                if command:
+                    self._commandsWaiting -= 1
+                    self._condition.notify_all()
+
+            # update the wait time counters
+            wait = time.monotonic() - start
+            stats = self._stats["command" if command else "read"]
+            stats["requests"] += 1
+            if wait > 0.001:
+                stats["delayed"] += 1
+                stats["totalWait"] += wait
+                stats["maxWait"] = max(stats["maxWait"], wait)
+
+        return wait
+
+    def getStats(self):
+        with self._condition:
+            return {kind: dict(stats, totalWait=round(stats["totalWait"], 3), maxWait=round(stats["maxWait"], 3)) for kind, stats in self._stats.items()}
+
+# Circuit breaker for the API calls - opens after consecutive failures of the service so that calls fail
+# fast while the service is down, then allows a single probe call (half-open) after the reset timeout
+class _CircuitBreaker(object):
+
+    state = BREAKER_STATE_CLOSED
+    failures = 0
+    openedAt = 0.0
+    resetTimeout = _BREAKER_RESET_TIMEOUT
+    _probeInFlight = False
+    _lock = None
+    _logger = None
+
+    def __init__(self, logger):
+        self._lock = threading.Lock()
+        self._logger = logger
+
+    # determine whether a call may be made, moving from open to half-open after the reset timeout
+    def allowRequest(self):
+        with self._lock:
+            if self.state == BREAKER_STATE_OPEN:
+                if time.time() - self.openedAt < self.resetTimeout:
+                    return False
+                self._logger.info("Circuit breaker half-open - probing the iAquaLink service.")
+                self.state = BREAKER_STATE_HALF_OPEN
+                self._probeInFlight = False
+            if self.state == BREAKER_STATE_HALF_OPEN:
+                if self._probeInFlight:
+                    return False
+                self._probeInFlight = True
+            return True
+
+    # release an allowed call that was not made (e.g., the probe when half-open)
+    def cancelRequest(self):
+        with self._lock:
+            self._probeInFlight = False
+
+    def recordSuccess(self):
+        with self._lock:
+            if self.state != BREAKER_STATE_CLOSED:
+                self._logger.info("Circuit breaker closed - the iAquaLink service is available.")
+            self.state = BREAKER_STATE_CLOSED
+            self.failures = 0
+            self.resetTimeout = _BREAKER_RESET_TIMEOUT
+            self._probeInFlight = False
+
+    def recordFailure(self):
+        with self._lock:
+            self.failures += 1
+            self._probeInFlight = False
+            if self.state == BREAKER_STATE_HALF_OPEN:
+                self.resetTimeout = min(self.resetTimeout * 2, _BREAKER_MAX_RESET_TIMEOUT)
+            elif self.state != BREAKER_STATE_CLOSED or self.failures < _BREAKER_FAILURE_THRESHOLD:
+                return
+            self._logger.warning("Circuit breaker open - iAquaLink service calls suspended for %d seconds.", self.resetTimeout)
+            self.state = BREAKER_STATE_OPEN
+            self.openedAt = time.time()
+
+    # get the state, reporting half-open once the reset timeout has passed
+    def getState(self):
+        with self._lock:
+            if self.state == BREAKER_STATE_OPEN and time.time() - self.openedAt >= self.resetTimeout:
+                return BREAKER_STATE_HALF_OPEN
+            return self.state
+
+# Rolling window of the latencies observed for each endpoint and command
+class _LatencyTracker(object):
+
+    _latencies = None
+    _lock = None
+
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, latency):
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=_LATENCY_WINDOW)
+            latencies.append(latency)
+
+    # get the specified percentile (0-100) of the latencies for the key, or None if too few latencies
+    def percentile(self, key, pct, minSamples=_LATENCY_MIN_SAMPLES):
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < minSamples:
+                return None
+            latencies = sorted(latencies)
+        return latencies[max(ceil(len(latencies) * pct / 100) - 1, 0)]
+
+    # get the sample count and the p50, p95, and p99 latencies for each key
+    def getStats(self):
+        with self._lock:
+            keys = list(self._latencies)
+        stats = {}
+        for key in keys:
+            with self._lock:
+                samples = len(self._latencies[key])
+            stats[key] = {"samples": samples}
+            for pct in (50, 95, 99):
+                latency = self.percentile(key, pct, 1)
+                stats[key]["p%d" % pct] = round(latency, 3) if latency is not None else None
+        return stats
+
+# Counters and latency histograms for the API calls, cheap enough to be left on in production
+# Note: each call is recorded with a single lock acquisition and a bisect of the bucket bounds
+class _Metrics(object):
+
+    _calls = None
+    _errors = None
+    _recentErrors = None
+    _totals = None
+    _tokenRefresh = None
+    _exporter = None
+    _lock = None
+    _logger = None
+    startTime = 0
+
+    def __init__(self, logger):
+        self._calls = {}
+        self._errors = {}
+        self._recentErrors = deque(maxlen=_METRICS_ERROR_PERIOD // 60 + 1)
+        self._totals = {"calls": 0, "sent": 0, "totalTime": 0.0, "errors": 0}
+        self._tokenRefresh = {"count": 0, "failed": 0, "totalTime": 0.0, "maxTime": 0.0, "lastTime": None}
+        self._lock = threading.Lock()
+        self._logger = logger
+        self.startTime = time.time()
+
+    # set the exporter called with each metrics event, or None to remove it
+    def setExporter(self, exporter):
+        self._exporter = exporter
+
+    # record an API call - latency is None for calls skipped without a request being sent
+    def recordCall(self, key, latency, error=None, bytesReceived=0):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = {"count": 0, "errors": 0, "bytes": 0, "totalTime": 0.0, "buckets": [0] * (len(_METRICS_LATENCY_BUCKETS) + 1)}
+            call["count"] += 1
+            call["bytes"] += bytesReceived
+            self._totals["calls"] += 1
+            if latency is not None:
+                call["totalTime"] += latency
+                call["buckets"][bisect_left(_METRICS_LATENCY_BUCKETS, latency)] += 1
+                self._totals["sent"] += 1
+                self._totals["totalTime"] += latency
+            if error is not None:
+                call["errors"] += 1
+                self._errors[error] = self._errors.get(error, 0) + 1
+            if error is not None and error not in _METRICS_SKIP_ERRORS:
+                self._totals["errors"] += 1
+
+                # count the error in the bucket for the current minute
+                minute = int(time.time() // 60)
+                if self._recentErrors and self._recentErrors[-1][0] == minute:
+                    self._recentErrors[-1][1] += 1
+                else:
+                    self._recentErrors.append([minute, 1])
+        self._export({"type": "call", "key": key, "latency": latency, "error": error, "bytes": bytesReceived})
+
+    # record a refresh of the session tokens
+    def recordTokenRefresh(self, duration, success):
+        with self._lock:
+            self._tokenRefresh["count"] += 1
+            if not success:
+                self._tokenRefresh["failed"] += 1
+            self._tokenRefresh["totalTime"] += duration
+            self._tokenRefresh["maxTime"] = max(self._tokenRefresh["maxTime"], duration)
+            self._tokenRefresh["lastTime"] = duration
+        self._export({"type": "tokenRefresh", "key": "login", "latency": duration, "error": None if success else "failed", "bytes": 0})
+
+    # pass an event to the exporter, if any - exporter errors are logged and never fail the API call
+    def _export(self, event):
+        exporter = self._exporter
+        if exporter is not None:
+            try:
+                exporter(event)
+            except Exception as e:
+                self._logger.debug("Metrics exporter failed: %s", str(e))
+
+    # get the totals for all of the calls and the errors in the recent error period
+    def getTotals(self):
+        since = int(time.time() // 60) - _METRICS_ERROR_PERIOD // 60
+        with self._lock:
+            totals = dict(self._totals)
+            totals["recentErrors"] = sum(count for minute, count in self._recentErrors if minute > since)
+        return totals
+
+    # get a snapshot of the counters and histograms
+    def getSnapshot(self):
+        with self._lock:
+            calls = {key: dict(call, buckets=list(call["buckets"])) for key, call in self._calls.items()}
+            errors = dict(self._errors)
+            tokenRefresh = dict(self._tokenRefresh)
+        bounds = [str(bound) for bound in _METRICS_LATENCY_BUCKETS] + ["+Inf"]
+        for call in calls.values():
+            sent = sum(call["buckets"])
+            call["avgTime"] = round(call["totalTime"] / sent, 3) if sent else None
+            call["totalTime"] = round(call["totalTime"], 3)
+            call["buckets"] = dict(zip(bounds, call["buckets"]))
+        tokenRefresh["avgTime"] = round(tokenRefresh["totalTime"] / tokenRefresh["count"], 3) if tokenRefresh["count"] else None
+        return {
+            "uptime": round(time.time() - self.startTime, 1),
+            "calls": calls,
+            "errors": errors,
+            "errorsLastHour": self.getTotals()["recentErrors"],
+            "bytesReceived": sum(call["bytes"] for call in calls.values()),
+            "tokenRefresh": tokenRefresh,
+        }
+
+# Format a metrics snapshot as lines of text
+def _formatMetrics(metrics):
+
+    lines = ["iAquaLink API metrics (uptime %.0f seconds):" % metrics["uptime"]]
+    for key, call in sorted(metrics["calls"].items()):
+        lines.append("  %s: calls %d, errors %d, bytes %d, avg %s" % (key, call["count"], call["errors"], call["bytes"], "%.3fs" % call["avgTime"] if call["avgTime"] is not None else "-"))
+        lines.append("    " + " ".join("<=%s:%d" % (bound, count) if bound != "+Inf" else ">%s:%d" % (_METRICS_LATENCY_BUCKETS[-1], count) for bound, count in call["buckets"].items()))
+    lines.append("  errors: " + (", ".join("%s %d" % error for error in sorted(metrics["errors"].items())) or "none") + " (%d in the last hour)" % metrics["errorsLastHour"])
+    lines.append("  bytes received: %d" % metrics["bytesReceived"])
+    tokenRefresh = metrics["tokenRefresh"]
+    lines.append("  token refreshes: %d (failed %d), avg %s, max %.3fs" % (tokenRefresh["count"], tokenRefresh["failed"], "%.3fs" % tokenRefresh["avgTime"] if tokenRefresh["avgTime"] is not None else "-", tokenRefresh["maxTime"]))
+    for name in ("breaker", "connections", "reads", "rateLimiter", "latencies"):
+        if name in metrics:
+            lines.append("  %s: %s" % (name, metrics[name]))
+    return "\n".join(lines)
+
+# HTTP adapter for a single API host that keeps a pool of keep-alive connections and counts
+# the requests sent and the new connections (TCP/TLS handshakes) made
+class _PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+
+    requestCount = 0
+    connectCount = 0
+    _countLock = None
+    _latencies = None
+    _latencyKey = ""
+
+    def __init__(self, poolSize, latencies=None, latencyKey=""):
+        self._countLock = threading.Lock()
+        self._latencies = latencies
+        self._latencyKey = latencyKey
+        super(_PooledHTTPAdapter, self).__init__(pool_connections=1, pool_maxsize=poolSize)
+
+    # setup the pool manager to create connections that count their connects
+    def init_poolmanager(self, *args, **kwargs):
+        super(_PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+        adapter = self
+
+        class _HTTPConnection(urllib3.connection.HTTPConnection):
+            def connect(self):
+                adapter._countConnect()
+                start = time.monotonic()
+                super(_HTTPConnection, self).connect()
+                adapter._recordConnect(time.monotonic() - start)
+
+        class _HTTPSConnection(urllib3.connection.HTTPSConnection):
+            def connect(self):
+                adapter._countConnect()
+                start = time.monotonic()
+                super(_HTTPSConnection, self).connect()
+                adapter._recordConnect(time.monotonic() - start)
+
+        class _HTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+            ConnectionCls = _HTTPConnection
+
+        class _HTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+            ConnectionCls = _HTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+
+    def _countConnect(self):
+        with self._countLock:
+            self.connectCount += 1
+
+    # record the latency of a connect (TCP and TLS handshakes) for adapting the connect timeout
+    def _recordConnect(self, latency):
+        if self._latencies is not None:
+            self._latencies.record(self._latencyKey, latency)
+
+    def send(self, request, **kwargs):
+        with self._countLock:
+            self.requestCount += 1
+        return super(_PooledHTTPAdapter, self).send(request, **kwargs)
+
 # interface class for a particular Bond Bridge or SBB device
 class iAqualinkConnection(object):
 
@@ -93,63 +707,254 @@ class iAqualinkConnection(object):
     _sessionTTL = 0
     _lastTokenUpdate = 0
     _iaqualinkSession = None
+    _tokenLock = None
+    _loginInFlight = None
+    _refreshTimer = None
+    _closed = False
+    _adapters = None
+    _apiHost = None
+    _stateCacheAge = 0
+    _stateCache = None
+    _cacheLock = None
+    _fingerprints = None
+    _readsInFlight = None
+    _readStats = None
+    _rateLimiter = None
+    _breaker = None
+    _latencies = None
+    _metrics = None
+    _minTimeout = _DEFAULT_MIN_TIMEOUT
+    _maxTimeout = None
+    _hedgeExecutor = None
     _logger = None
 
     # Primary constructor method
-    def __init__(self, sessionTTL=_DEFAULT_SESSION_TTL, logger=_LOGGER):
+    def __init__(self, sessionTTL=_DEFAULT_SESSION_TTL, stateCacheAge=_DEFAULT_STATE_CACHE_AGE, poolSizes=None, apiHost=None, rateLimit=_DEFAULT_RATE_LIMIT, serialRateLimit=_DEFAULT_SERIAL_RATE_LIMIT, minTimeout=_DEFAULT_MIN_TIMEOUT, maxTimeout=None, hedgeReads=False, logger=_LOGGER):
 
         self._sessionTTL = sessionTTL
+        self._stateCacheAge = stateCacheAge
         self._logger = logger
 
+        # base URL of a stand-in for all of the API hosts, e.g. "http://localhost:8080" (for testing)
+        self._apiHost = apiHost.rstrip("/") if apiHost else None
+
+        # cache of the last state data retrieved, keyed by session command and serial number
+        self._stateCache = {}
+        self._cacheLock = threading.Lock()
+
+        # fingerprint (CRC-32) of the last raw response and the state built from it, keyed by (command, serial)
+        # Note: these are not discarded by invalidateStateCache() since they are not used to skip API calls
+        self._fingerprints = {}
+
+        # reads in flight keyed by (command, serial), shared by concurrent callers, and the read counters
+        self._readsInFlight = {}
+        self._readStats = {"requests": 0, "shared": 0, "cached": 0, "hedged": 0, "hedgeWins": 0}
+
+        # threads for sending hedged state reads, if enabled
+        if hedgeReads:
+            self._hedgeExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=_HEDGE_MAX_WORKERS, thread_name_prefix="iAquaHedge")
+
+        # client-side rate limiter for all of the API calls and for the API calls for each system
+        self._rateLimiter = _RateLimiter(rateLimit, serialRateLimit)
+
+        # circuit breaker for failing fast while the service is down
+        self._breaker = _CircuitBreaker(logger)
+
+        # latencies observed for each endpoint and command for adapting the HTTP timeouts within the bounds
+        # Note: the maximum timeout defaults to the fixed timeouts for GET and POST calls
+        self._latencies = _LatencyTracker()
+        self._minTimeout = minTimeout
+        self._maxTimeout = maxTimeout
+
+        # instrumentation of the API calls and token refreshes
+        self._metrics = _Metrics(logger)
+
         # open an HTTP session
         self._iaqualinkSession = requests.Session()
 
+        # mount a pool of keep-alive connections for each API host, sized from the defaults
+        # overridden by any specified pool sizes
+        sizes = dict(_DEFAULT_POOL_SIZES)
+        if poolSizes:
+            sizes.update(poolSizes)
+        if self._apiHost:
+            sizes = {self._apiHost: max(sizes.values())}
+        else:
+            sizes = {"https://" + host: size for host, size in sizes.items()}
+        self._adapters = {}
+        for baseURL, size in sizes.items():
+            adapter = _PooledHTTPAdapter(size, self._latencies, "connect " + urlsplit(baseURL).netloc)
+            self._iaqualinkSession.mount(baseURL, adapter)
+            self._adapters[baseURL] = adapter
+
+        # lock to serialize token updates between the refresh thread and the polling threads
+        self._tokenLock = threading.Lock()
+
     # Call the specified REST API
-    def _call_api(self, api, params=None, payload=None):
+    # Note: if a deadline (time.monotonic() value) is specified, the timeouts are shortened to meet it
+    # Note: a hedge request (see _hedgedCall) rejected by the circuit breaker is not counted as an error,
+    # since the primary request is still outstanding
+    def _call_api(self, api, params=None, payload=None, deadline=None, hedge=False):
       
         method = api["method"]
         url = api["url"]
+        command = params.get("command", "") if params else ""
+        latencyKey = _latencyKey(api, command)
+
+        # redirect the request to the stand-in API host, if specified
+        if self._apiHost:
+            url = self._apiHost + urlsplit(url).path
+
+        # fail fast while the circuit breaker is open
+        if not self._breaker.allowRequest():
+            self._logger.debug("HTTP %s in _call_api() skipped - the iAquaLink service is unavailable.", method)
+            if not hedge:
+                self._metrics.recordCall(latencyKey, None, METRICS_ERROR_CIRCUIT_OPEN)
+            return None
 
-        # uncomment the next line to dump HTTP request data to log file for debugging
-        #self._logger.debug("HTTP %s data: %s", method + " " + url, payload if params is None else params)
+        # only retry idempotent calls - the session API uses GET for commands (set_...) as well as reads (get_...)
+        attempts = _RETRY_ATTEMPTS if method == "GET" and (not command or command.startswith("get_")) else 1
 
-        try:
-            response = self._iaqualinkSession.request(
-                method,
-                url,
-                json = payload,
-                params = params, 
-                headers = _API_HTTP_HEADERS, # same every call     
-                timeout= _HTTP_POST_TIMEOUT if method == "POST" else _HTTP_GET_TIMEOUT
-            )
-            
-            # raise any codes other than 200, 201, and 401 for error handling 
-            if response.status_code not in (200, 201, 401):
-                response.raise_for_status()
+        attempt = 0
+        while True:
+            attempt += 1
 
-        # Allow timeout and connection errors to be ignored - log and return false
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
-            self._logger.warning("HTTP %s in _call_api() failed: %s", method, str(e))
-            return None
-        except:
-            self._logger.error("Unexpected error occured: %s", sys.exc_info()[0])
-            raise
+            # wait for the rate limiter, up to the deadline - state reads (get_ commands) yield to the other API calls
+            wait = self._rateLimiter.acquire(params.get("serial") if params else None, not command.startswith("get_"), deadline)
+            if wait is not None and wait > 1.0:
+                self._logger.debug("HTTP %s delayed %.1f seconds by the rate limiter.", method, wait)
+
+            # determine the timeouts from the observed latencies and the deadline, if any (none if the wait
+            # for the rate limiter reached the deadline)
+            timeout = None if wait is None else self._getTimeout(method, url, latencyKey, deadline)
+            if timeout is None:
+                self._logger.warning("HTTP %s in _call_api() skipped - the deadline has passed.", method)
+
+                # record the failure of the previous attempt with the circuit breaker (retries are only made
+                # for failures of the service), or release the call if no attempt was made
+                if attempt > 1:
+                    self._breaker.recordFailure()
+                else:
+                    self._breaker.cancelRequest()
+                self._metrics.recordCall(latencyKey, None, METRICS_ERROR_DEADLINE)
+                return None
+
+            # uncomment the next line to dump HTTP request data to log file for debugging
+            #self._logger.debug("HTTP %s data: %s", method + " " + url, payload if params is None else params)
+
+            start = time.monotonic()
+            try:
+                response = self._iaqualinkSession.request(
+                    method,
+                    url,
+                    json = payload,
+                    params = params, 
+                    headers = _API_HTTP_HEADERS, # same every call     
+                    timeout = timeout
+                )
+                latency = time.monotonic() - start
+                self._latencies.record(latencyKey, latency)
+                self._metrics.recordCall(latencyKey, latency, None if response.status_code in (200, 201) else "http_%d" % response.status_code, len(response.content))
+                
+                # raise any codes other than 200, 201, and 401 for error handling 
+                if response.status_code not in (200, 201, 401):
+                    response.raise_for_status()
+
+            # Allow timeout and connection errors to be ignored - log and return false
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+
+                # record timed out requests at the timeout so that the timeouts adapt upward
+                # Note: HTTP errors were recorded with the response
+                if isinstance(e, requests.exceptions.Timeout):
+                    self._latencies.record(latencyKey, time.monotonic() - start)
+                if not isinstance(e, requests.exceptions.HTTPError):
+                    self._metrics.recordCall(latencyKey, time.monotonic() - start, _errorType(e))
+
+                serviceFailure = _isServiceFailure(e)
+
+                # retry failures of the service with a jittered exponential backoff, within the deadline
+                delay = random.uniform(0, min(_RETRY_BASE_DELAY * 2 ** (attempt - 1), _RETRY_MAX_DELAY))
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    attempts = attempt
+                if serviceFailure and attempt < attempts:
+                    self._logger.info("HTTP %s in _call_api() failed (attempt %d of %d) - retrying in %.2f seconds: %s", method, attempt, attempts, delay, str(e))
+                    time.sleep(delay)
+                    continue
+
+                self._logger.warning("HTTP %s in _call_api() failed: %s", method, str(e))
+                if serviceFailure:
+                    self._breaker.recordFailure()
+                else:
+                    self._breaker.recordSuccess()
+                return None
+
+            except:
+                self._logger.error("Unexpected error occured: %s", sys.exc_info()[0])
+                self._metrics.recordCall(latencyKey, time.monotonic() - start, METRICS_ERROR_UNEXPECTED)
+                self._breaker.recordFailure()
+                raise
+
+            break
+
+        self._breaker.recordSuccess()
 
         # uncomment the next line to dump HTTP response to log file for debugging
         #self._logger.debug("HTTP response code: %d data: %s", response.status_code, response.text)
 
         return response
 
+    # Determine the (connect, read) timeouts for a call from the latencies observed for the host and the
+    # endpoint and command, bounded by the minimum and maximum timeouts and by the deadline, if any
+    # Note: returns None if the deadline has passed
+    def _getTimeout(self, method, url, latencyKey, deadline=None):
+
+        maxTimeout = self._maxTimeout or (_HTTP_POST_TIMEOUT if method == "POST" else _HTTP_GET_TIMEOUT)
+        minTimeout = min(self._minTimeout, maxTimeout)
+
+        timeouts = []
+        for key, minSamples in (("connect " + urlsplit(url).netloc, _CONNECT_MIN_SAMPLES), (latencyKey, _LATENCY_MIN_SAMPLES)):
+            latency = self._latencies.percentile(key, 99, minSamples)
+            if latency is None:
+                timeouts.append(maxTimeout)
+            else:
+                timeouts.append(min(max(latency * _TIMEOUT_LATENCY_FACTOR, minTimeout), maxTimeout))
+
+        # shorten the timeouts to meet the deadline
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            timeouts = [min(timeout, remaining) for timeout in timeouts]
+
+        return tuple(timeouts)
+
     # Update the session ID and authentication tokens if the TTL has expired
+    # Note: the tokens are normally refreshed in the background ahead of the TTL expiring, so this
+    # only blocks if the background refresh has failed or is currently in progress
     def _checkTokens(self):
 
         # check TTL time
-        currentTime = time.time()
-        if currentTime - self._lastTokenUpdate > self._sessionTTL:
+        if time.time() - self._lastTokenUpdate > self._sessionTTL:
+            self._refreshTokens()
+
+    # Retrieve new session ID and authentication tokens from the login API
+    # Note: concurrent callers share a single login call in flight
+    def _refreshTokens(self):
+
+        # join the login call already in flight, if any
+        with self._tokenLock:
+            inFlight = self._loginInFlight
+            if inFlight is None:
+                self._loginInFlight = threading.Event()
+        if inFlight is not None:
+            inFlight.wait(_HTTP_POST_TIMEOUT * 2)
+            return
+
+        self._logger.debug("Refreshing iAquaLink session tokens...")
+        success = False
+        start = time.monotonic()
 
-            # close the current session and delay for a few seconds
-            self._iaqualinkSession.close()
-            time.sleep(2)
+        try:
 
             # format payload
             payload = {
@@ -168,10 +973,13 @@ class iAqualinkConnection(object):
 
                 if response.status_code == 200:
 
-                    self._sessionID = respData["session_id"]
-                    self._authToken = respData["authentication_token"]
+                    # swap in the new tokens together
+                    with self._tokenLock:
+                        self._sessionID = respData["session_id"]
+                        self._authToken = respData["authentication_token"]
+                        self._lastTokenUpdate = time.time()
 
-                    self._lastTokenUpdate = time.time()
+                    success = True
                 
                 else:
                     # otherwise just log it and try to keep going with current tokens
@@ -182,6 +990,38 @@ class iAqualinkConnection(object):
                 # logged in _call_api()
                 pass
 
+        # release the callers waiting on this login and schedule the next refresh
+        finally:
+            self._metrics.recordTokenRefresh(time.monotonic() - start, success)
+
+            with self._tokenLock:
+                inFlight = self._loginInFlight
+                self._loginInFlight = None
+            inFlight.set()
+
+            self._scheduleRefresh(success)
+
+    # Schedule a background refresh of the tokens ahead of the TTL expiring, or a retry of a failed refresh
+    def _scheduleRefresh(self, success=True):
+
+        if success:
+            delay = max(self._sessionTTL - _SESSION_REFRESH_MARGIN, self._sessionTTL / 2)
+        else:
+            delay = min(_SESSION_REFRESH_RETRY, self._sessionTTL)
+
+        timer = threading.Timer(delay, self._refreshTokens)
+        timer.daemon = True
+
+        # replace any currently scheduled refresh, unless the connection has been closed
+        with self._tokenLock:
+            if self._closed:
+                return
+            if self._refreshTimer is not None:
+                self._refreshTimer.cancel()
+            self._refreshTimer = timer
+
+        timer.start()
+
     # Login to the cloud service and retrieve session_id, user_id, and authentication_token
     # to access the remainder of the API
     def loginToService(self, userName, password):
@@ -222,6 +1062,9 @@ class iAqualinkConnection(object):
 
                 self._lastTokenUpdate = time.time()
 
+                # refresh the tokens in the background ahead of the TTL expiring
+                self._scheduleRefresh()
+
                 return LOGIN_SUCCESS
 
 
@@ -266,14 +1109,154 @@ class iAqualinkConnection(object):
         else:
             return False
 
+    # Get the state data for a session command from the state cache, or from the API if the
+    # cached data is older than maxAge seconds
+    def _getSessionState(self, command, serialNum, maxAge, buildState, deadline=None):
+
+        key = (command, serialNum)
+
+        # return the cached state data if it is fresh enough for the caller
+        if maxAge:
+            with self._cacheLock:
+                entry = self._stateCache.get(key)
+                if entry is not None and time.time() - entry[0] <= maxAge:
+                    self._readStats["cached"] += 1
+                    return entry[1]
+
+        # join an identical read already in flight, if any, and share its result
+        with self._cacheLock:
+            inFlight = self._readsInFlight.get(key)
+            if inFlight is None:
+                read = self._readsInFlight[key] = concurrent.futures.Future()
+                self._readStats["requests"] += 1
+            else:
+                self._readStats["shared"] += 1
+        # Note: without a deadline the caller waits for the whole read, including its retries, since the
+        # result is always set when the read completes
+        if inFlight is not None:
+            wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                return inFlight.result(wait)
+            except concurrent.futures.TimeoutError:
+                return None
+
+        # note the time of the request (not the response) for the age of the cached data
+        requestTime = time.time()
+
+        state = None
+        try:
+            state = self._readSessionState(command, serialNum, buildState, deadline)
+
+        # cache the state data, unless the cache was invalidated (e.g., by a command) while the read
+        # was in flight, and release the callers waiting on this read
+        finally:
+            with self._cacheLock:
+                if self._readsInFlight.get(key) is read:
+                    del self._readsInFlight[key]
+                    if state is not None:
+                        self._stateCache[key] = (requestTime, state)
+            read.set_result(state)
+
+        return state
+
+    # Retrieve state data from the session API (None on failure)
+    def _readSessionState(self, command, serialNum, buildState, deadline=None):
+
+        key = (command, serialNum)
+
+        # format url parameters
+        params = {
+           "actionID": "command",
+           "command": command,
+           "serial": serialNum,
+           "sessionID": self._sessionID,
+        } 
+
+        # call the session API with the parameters, hedging the request if enabled
+        if self._hedgeExecutor is not None:
+            response = self._hedgedCall(_API_SESSION, params, deadline)
+        else:
+            response = self._call_api(_API_SESSION, params=params, deadline=deadline)
+        
+        # if data returned, format the state data and return it
+        if response and response.status_code == 200:
+
+            # if the raw response is identical to the last one, then skip parsing and return the
+            # same state object, allowing callers to skip any processing of unchanged state
+            fingerprint = zlib.crc32(response.content)
+            with self._cacheLock:
+                last = self._fingerprints.get(key)
+            if last is not None and last[0] == fingerprint:
+                state = last[1]
+            else:
+                state = buildState(response.json(), serialNum)
+
+            with self._cacheLock:
+                self._fingerprints[key] = (fingerprint, state)
+            return state
+            
+        # otherwise return None
+        else:
+            return None
+
+    # Call the API for an idempotent read, sending a duplicate (hedge) request if the first has not responded
+    # by the p95 latency, and return the first successful response
+    # Note: requests cannot be interrupted, so the losing request is abandoned and its response discarded
+    def _hedgedCall(self, api, params, deadline=None):
+
+        primary = self._hedgeExecutor.submit(self._call_api, api, params, None, deadline)
+
+        # wait for the primary request up to the p95 latency (no hedging until enough latencies are observed)
+        hedgeDelay = self._latencies.percentile(_latencyKey(api, params.get("command", "")), 95)
+        if hedgeDelay is None:
+            return primary.result()
+        try:
+            return primary.result(hedgeDelay)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        # send the hedge request only while the circuit breaker is closed (a half-open breaker allows only
+        # the probe request), and if within the budget
+        if self._breaker.getState() != BREAKER_STATE_CLOSED:
+            return primary.result()
+        with self._cacheLock:
+            allowed = self._readStats["hedged"] < self._readStats["requests"] * _HEDGE_BUDGET + _HEDGE_BURST
+            if allowed:
+                self._readStats["hedged"] += 1
+        if not allowed:
+            return primary.result()
+
+        self._logger.debug("Hedging %s request after %.3f seconds.", params.get("command"), hedgeDelay)
+        hedge = self._hedgeExecutor.submit(self._call_api, api, params, None, deadline, True)
+
+        # use the first successful response, otherwise the last response
+        response = None
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                response = future.result()
+                if response is not None and response.status_code == 200:
+                    if future is hedge:
+                        with self._cacheLock:
+                            self._readStats["hedgeWins"] += 1
+                    for loser in pending:
+                        loser.add_done_callback(_discardResponse)
+                    return response
+
+        return response
+
     # Get system state information by serial number
-    def getSystemState(self, serialNum, internal=False):
+    def getSystemState(self, serialNum, internal=False, maxAge=0, deadline=None):
         """Get state information for a specific system (pool controller)
 
         Parameters:
         serialNum -- serial number from systems list of pool controller (string)
+        maxAge -- maximum age in seconds of cached state information to accept (optional - defaults to 0, always retrieve)
+        deadline -- time.monotonic() value by which the call must complete (optional - defaults to none)
         Returns:
-        dictionary of state attributes for specified system
+        state record (SystemState) with dictionary style access to the state attributes for specified system
+        (the same record is returned while the API response is unchanged)
         """
 
         self._logger.debug("in API getSystemStatus()...")
@@ -282,35 +1265,28 @@ class iAqualinkConnection(object):
         if not internal:
             self._checkTokens()
 
-        # format url parameters
-        params = {
-           "actionID": "command",
-           "command": _SESSION_COMMAND_GET_HOME,
-           "serial": serialNum,
-           "sessionID": self._sessionID,
-        } 
-
-        # call the session API with the parameters
-        response  = self._call_api(_API_SESSION, params=params)
+        # get the system state from the cache or the API
+        systemState = self._getSessionState(_SESSION_COMMAND_GET_HOME, serialNum, maxAge, self._buildSystemState, deadline)
         
-        # if data returned, format system state and return
-        if response and response.status_code == 200:
-
-            respData = response.json()
-            return self._buildSystemState(respData)
+        # if data returned, return the system state
+        if systemState is not None:
+            return systemState
             
         # otherwise return error (False)
         else:
             return False
 
     # Get device state information for a controller
-    def getDevicesList(self, serialNum, internal=False):
+    def getDevicesList(self, serialNum, internal=False, maxAge=0, deadline=None):
         """Get state information for devices (aux relays) for specific system (pool controller)
 
         Parameters:
         serialNum -- serial number from systems list of pool controller (string)
+        maxAge -- maximum age in seconds of cached state information to accept (optional - defaults to 0, always retrieve)
+        deadline -- time.monotonic() value by which the call must complete (optional - defaults to none)
         Returns:
         dictionary of devices (aux relays) with state attributes for each
+        (the same dictionary is returned while the API response is unchanged - do not modify)
         """
 
         self._logger.debug("in API getDevicesList()...")
@@ -319,45 +1295,59 @@ class iAqualinkConnection(object):
         if not internal:
             self._checkTokens()
 
-        # format url parameters
-        params = {
-           "actionID": "command",
-           "command": _SESSION_COMMAND_GET_DEVICES,
-           "serial": serialNum,
-           "sessionID": self._sessionID,
-        } 
-
-        # call the session API with the parameters
-        response  = self._call_api(_API_SESSION, params=params)
+        # get the devices state from the cache or the API
+        devices = self._getSessionState(_SESSION_COMMAND_GET_DEVICES, serialNum, maxAge, self._buildDevicesState, deadline)
         
-        # if data returned, format devices state and return
-        if response and response.status_code == 200:
-
-            respData = response.json()           
-            return self._buildDevicesState(respData)
+        # if data returned, return the devices state
+        if devices is not None:
+            return devices
 
         # otherwise return empty dictionary (evaluates to false)
         else:
             return {}
 
+    # Remove cached state data for a system, e.g., after a command changes the state
+    def invalidateStateCache(self, serialNum=None):
+        """Discard cached state information so that the next request retrieves it from the API
+
+        Parameters:
+        serialNum -- serial number of pool controller to discard state information for (optional - defaults to all)
+        """
+
+        # also detach any reads in flight so that later callers don't share results from before the invalidation
+        with self._cacheLock:
+            if serialNum is None:
+                self._stateCache.clear()
+                self._readsInFlight.clear()
+            else:
+                for key in [key for key in self._stateCache if key[1] == serialNum]:
+                    del self._stateCache[key]
+                for key in [key for key in self._readsInFlight if key[1] == serialNum]:
+                    del self._readsInFlight[key]
+
     # Get device state a device
-    def getDeviceState(self, serialNum, deviceName):
+    def getDeviceState(self, serialNum, deviceName, maxAge=None):
         """Get the state information for the specified device
 
         Parameters:
         serialNum -- serial number from systems list of pool controller (string)
         deviceName -- serial number from systems list of pool controller (string)
+        maxAge -- maximum age in seconds of cached state information to accept (optional - defaults to stateCacheAge)
         Returns:
         state value for the device of "" if unknown or error (string) 
         """
 
         self._logger.debug("in API getDeviceState()...")
 
+        # use the default cache age for the connection if not specified
+        if maxAge is None:
+            maxAge = self._stateCacheAge
+
         # determine whether the device is a system device or an aux relay
         if deviceName in (DEVICE_NAME_PUMP, DEVICE_NAME_SPA, DEVICE_NAME_POOL_HEAT, DEVICE_NAME_SPA_HEAT, DEVICE_NAME_SOLAR_HEAT):
             
             # get the current system state
-            systemState = self.getSystemState(serialNum, True)
+            systemState = self.getSystemState(serialNum, True, maxAge)
             
             # return the current state for the device
             if systemState and deviceName in systemState:
@@ -367,7 +1357,7 @@ class iAqualinkConnection(object):
 
         else:
             # get the device list with state
-            devices = self.getDevicesList(serialNum, True)
+            devices = self.getDevicesList(serialNum, True, maxAge)
 
             # return the current state for the device
             if devices and deviceName in devices:
@@ -412,6 +1402,9 @@ class iAqualinkConnection(object):
 
         # call the session API with the parameters
         response  = self._call_api(_API_SESSION, params=params)
+
+        # the cached state for the system is no longer valid
+        self.invalidateStateCache(serialNum)
         
         # too much latency in the status change to return the new state, so just ignore 
         if response and response.status_code == 200:
@@ -451,6 +1444,9 @@ class iAqualinkConnection(object):
 
         # call the session API with the parameters
         response  = self._call_api(_API_SESSION, params=params)
+
+        # the cached state for the system is no longer valid
+        self.invalidateStateCache(serialNum)
         
         if response and response.status_code == 200:
 
@@ -489,6 +1485,9 @@ class iAqualinkConnection(object):
 
         # call the session API with the parameters
         response  = self._call_api(_API_SESSION, params=params)
+
+        # the cached state for the system is no longer valid
+        self.invalidateStateCache(serialNum)
         
         if response and response.status_code == 200:
 
@@ -529,6 +1528,9 @@ class iAqualinkConnection(object):
 
         # call the session API with the parameters
         response  = self._call_api(_API_SESSION, params=params)
+
+        # the cached state for the system is no longer valid
+        self.invalidateStateCache(serialNum)
         
         if response and response.status_code == 200:
 
@@ -538,34 +1540,186 @@ class iAqualinkConnection(object):
         else:
             return False
 
+    # Open connections to the API hosts ahead of the first requests
+    def warmUpConnections(self):
+        """Establish a keep-alive connection to each API host so that the first requests do not pay the TLS setup cost"""
+
+        self._logger.debug("in API warmUpConnections()...")
+
+        for baseURL in self._adapters:
+            try:
+                self._iaqualinkSession.head(baseURL + "/", headers=_API_HTTP_HEADERS, timeout=_HTTP_POST_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                self._logger.debug("Connection warm-up for %s failed: %s", baseURL, str(e))
+
+    # Get the connection pool counters for each API host
+    def getConnectionStats(self):
+        """Get the number of requests sent and new connections made to each API host
+
+        Returns:
+        dictionary of counters ("requests", "connects", "reused") for each API host
+        """
+
+        stats = {}
+        for baseURL, adapter in self._adapters.items():
+            with adapter._countLock:
+                requestCount = adapter.requestCount
+                connectCount = adapter.connectCount
+            stats[urlsplit(baseURL).netloc] = {
+                "requests": requestCount,
+                "connects": connectCount,
+                "reused": max(requestCount - connectCount, 0),
+            }
+
+        return stats
+
+    # Get the state read counters
+    def getReadStats(self):
+        """Get the number of state reads sent to the API and the number of reads saved by sharing results
+
+        Returns:
+        dictionary of counters ("requests" - reads sent, "shared" - reads joining an identical read in flight,
+        "cached" - reads served from the state cache, "hedged" - hedge requests sent, "hedgeWins" - reads
+        answered by the hedge request)
+        """
+
+        with self._cacheLock:
+            return dict(self._readStats)
+
+    # Get the latency percentiles
+    def getLatencyStats(self):
+        """Get the latencies observed for each API endpoint and command, and for connects to each API host
+
+        Returns:
+        dictionary of the sample count and the p50, p95, and p99 latencies (seconds) for each endpoint and command
+        """
+
+        return self._latencies.getStats()
+
+    # Get the state of the circuit breaker
+    def getBreakerState(self):
+        """Get the state of the circuit breaker for the iAquaLink service
+
+        Returns:
+        BREAKER_STATE_CLOSED (service available), BREAKER_STATE_OPEN (service down - calls fail without
+        being sent), or BREAKER_STATE_HALF_OPEN (the next call probes the service)
+        """
+
+        return self._breaker.getState()
+
+    # Get the rate limiter counters
+    def getRateLimiterStats(self):
+        """Get the number of requests delayed by the client-side rate limiter and the time spent waiting
+
+        Returns:
+        dictionary of counters ("requests", "delayed", "totalWait", "maxWait" - seconds) for state reads ("read")
+        and all other API calls ("command")
+        """
+
+        return self._rateLimiter.getStats()
+
+    # Get the instrumentation metrics
+    def getMetrics(self):
+        """Get the metrics collected for the API calls since the connection was opened
+
+        Returns:
+        dictionary of the metrics: "uptime" (seconds), "calls" (count, errors, bytes received, total and average
+        time, and latency histogram for each endpoint and command), "errors" (count for each error type),
+        "errorsLastHour", "bytesReceived", "tokenRefresh" (count, failed, and total, average, max, and last duration), and the
+        "connections", "reads", "rateLimiter", "latencies", and "breaker" stats
+        """
+
+        metrics = self._metrics.getSnapshot()
+        metrics["connections"] = self.getConnectionStats()
+        metrics["reads"] = self.getReadStats()
+        metrics["rateLimiter"] = self.getRateLimiterStats()
+        metrics["latencies"] = self.getLatencyStats()
+        metrics["breaker"] = self.getBreakerState()
+
+        return metrics
+
+    # Get the totals of the instrumentation metrics
+    def getMetricsTotals(self):
+        """Get the totals for all of the API calls since the connection was opened - cheaper than getMetrics()
+
+        Returns:
+        dictionary of the totals: "calls" (API calls, including calls skipped by the circuit breaker or the
+        deadline), "sent" (requests sent), "totalTime" (seconds waiting on the requests sent), "errors", and
+        "recentErrors" (errors in the last hour)
+        """
+
+        return self._metrics.getTotals()
+
+    # Get the instrumentation metrics formatted for logging or saving to a file
+    def dumpMetrics(self, format=METRICS_FORMAT_TEXT):
+        """Get the metrics collected for the API calls as text or JSON
+
+        Parameters:
+        format -- METRICS_FORMAT_TEXT for lines of text or METRICS_FORMAT_JSON for a JSON document
+
+        Returns:
+        metrics string
+        """
+
+        metrics = self.getMetrics()
+        if format == METRICS_FORMAT_JSON:
+            return json.dumps(metrics, sort_keys=True)
+        else:
+            return _formatMetrics(metrics)
+
+    # Set the exporter for the instrumentation metrics
+    def setMetricsExporter(self, exporter):
+        """Set a function to be called with each metrics event, e.g. for forwarding the metrics to a monitoring system
+
+        Parameters:
+        exporter -- function called with an event dictionary: "type" ("call" or "tokenRefresh"), "key" (endpoint
+        and command), "latency" (seconds, or None for calls that were not sent), "error" (error type or None),
+        and "bytes" (bytes received), or None to remove the exporter
+        Note: the exporter is called on the thread making the API call and must return quickly
+        """
+
+        self._metrics.setExporter(exporter)
+
     # close any HTTP session
     def close(self):
+
+        # cancel any scheduled token refresh
+        with self._tokenLock:
+            self._closed = True
+            if self._refreshTimer is not None:
+                self._refreshTimer.cancel()
+                self._refreshTimer = None
+
+        # shutdown the hedged request threads
+        if self._hedgeExecutor is not None:
+            self._hedgeExecutor.shutdown(wait=False)
+
         self._iaqualinkSession.close()
             
-    # builds a system state dictionary from home screen response data
+    # builds a system state record from home screen response data in a single pass
     @staticmethod
-    def _buildSystemState(data):
-
-        systemState = {}
+    def _buildSystemState(data, serialNum=None):
 
-        # return a single dictionary with state attributes
-        for attr in data["home_screen"]:
-            systemState.update(attr)
-        
-        return systemState
+        return SystemState.fromAttributes(data["home_screen"], serialNum)
 
-    # builds a device state dictionary from devices screen response data
+    # builds a device state dictionary from devices screen response data in a single pass
     @staticmethod
-    def _buildDevicesState(data):
+    def _buildDevicesState(data, serialNum=None):
 
         devices = {}
-
-        # return a dictionary of devices with state subdictionary for each
-        for device in data["devices_screen"][3:]:
-            key = list(device.keys())[0]
-            deviceState = {}
-            for attr in device[key]:
-                deviceState.update(attr)
-            devices[key] = deviceState
-
-        return devices
\ No newline at end of file
+        intern = sys.intern
+
+        # skip the status, response, and group entries - each remaining entry is a single entry
+        # dictionary of the aux name to a list of single entry attribute dictionaries
+        for device in islice(data["devices_screen"], 3, None):
+            for key, attrs in device.items():
+
+                # intern the aux name since it is used as a key on every poll
+                # Note: a plain dictionary merge is the cheapest per device state in CPython (a state
+                # record per aux relay, even with the learned layout of SystemState, measured slower)
+                deviceState = {}
+                for attr in attrs:
+                    deviceState.update(attr)
+                devices[intern(key)] = deviceState
+
+        return devices
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the iAquaLink Mobile App API for testing iaquaapi and the nodeserver
+without the iAquaLink cloud service
+
+Usage: python iaquamock.py --port 8080 --systems 2 --aux 7 --latency 0.2
+
+Then point the nodeserver at it with the custom configuration parameter apiHost = http://localhost:8080
+"""
+
+import sys
+import json
+import random
+import threading
+import time
+import argparse
+import logging
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Configure a module level logger
+_LOGGER = logging.getLogger(__name__)
+
+# API paths served (the host part of the iAquaLink URLs is dropped by iAqualinkConnection)
+_PATH_LOGIN = "/users/v1/login"
+_PATH_SYSTEMS = "/devices.json"
+_PATH_SESSION = "/v1/mobile/session.json"
+
+# Aux device types and color light subtype assigned to the simulated aux relays
+_DEVICE_TYPE_DEFAULT = "0"
+_DEVICE_TYPE_DIMMABLE_RELAY = "1"
+_DEVICE_TYPE_COLOR_LIGHT = "2"
+_COLOR_LIGHT_SUBTYPE = "1" # JandyColors
+
+# heater states
+_HEATER_STATE_OFF = "0"
+_HEATER_STATE_ENABLED = "3"
+
+# time a stalled request is held (longer than the client HTTP timeouts)
+_DEFAULT_STALL_TIME = 10.0
+
+# Simulated iAquaLink service with state for a number of systems (pool controllers)
+class MockAqualinkService(object):
+
+    latency = 0.0
+    jitter = 0.0
+    errorRate = 0.0
+    stallRate = 0.0
+    stallTime = _DEFAULT_STALL_TIME
+    applyDelay = 0.0
+    systems = None
+    requestCounts = None
+    _pending = None
+    _lock = None
+    _random = None
+
+    def __init__(self, systems=1, auxDevices=7, latency=0.0, jitter=0.0, errorRate=0.0, stallRate=0.0, stallTime=_DEFAULT_STALL_TIME, applyDelay=0.0, extraAttributes=0, seed=None):
+        """Build the simulated service
+
+        Parameters:
+        systems -- number of systems (pool controllers) in the user profile (integer)
+        auxDevices -- number of aux relays for each system (integer)
+        latency -- base response latency in seconds (float)
+        jitter -- maximum random latency in seconds added to the base latency (float)
+        errorRate -- fraction of requests that fail with an HTTP 500 error (float)
+        stallRate -- fraction of requests that are held for stallTime seconds before responding (float)
+        stallTime -- seconds a stalled request is held (float)
+        applyDelay -- seconds before the result of a set_* command is reflected in the state (float)
+        extraAttributes -- number of filler attributes added to each home screen to increase payload size (integer)
+        seed -- seed for the random number generator (optional)
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.stallRate = stallRate
+        self.stallTime = stallTime
+        self.applyDelay = applyDelay
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._pending = []
+        self.requestCounts = Counter()
+
+        # build the state for each system
+        self.systems = {}
+        for n in range(1, systems + 1):
+            serialNum = "MOCK%08d" % n
+            self.systems[serialNum] = {
+                "id": 100000 + n,
+                "name": "Mock Pool %d" % n,
+                "home": self._buildHome(n, extraAttributes),
+                "devices": self._buildDevices(auxDevices),
+            }
+
+    # build the home screen attributes for a system
+    @staticmethod
+    def _buildHome(n, extraAttributes):
+
+        home = {
+            "status": "Online",
+            "response": "",
+            "system_type": "0",
+            "temp_scale": "F",
+            "spa_temp": "",
+            "pool_temp": "78",
+            "air_temp": "72",
+            "spa_set_point": "102",
+            "pool_set_point": "82",
+            "cover_pool": "0",
+            "spa_pump": "0",
+            "pool_pump": "1",
+            "spa_heater": _HEATER_STATE_OFF,
+            "pool_heater": _HEATER_STATE_OFF,
+            "solar_heater": "" if n % 2 else _HEATER_STATE_OFF,
+            "spa_salinity": "",
+            "pool_salinity": "64",
+            "orp": "65",
+            "ph": "74",
+            "freeze_protection": "0",
+            "relay_count": "7",
+            "is_icl_present": "absent",
+        }
+
+        # add filler attributes to increase the payload size
+        for i in range(extraAttributes):
+            home["extra_%d" % i] = "x" * 16
+
+        return home
+
+    # build the aux relays for a system
+    @staticmethod
+    def _buildDevices(auxDevices):
+
+        devices = {}
+        for i in range(1, auxDevices + 1):
+
+            # make every fifth relay a dimmable light and every seventh relay a color light
+            if i % 5 == 0:
+                devType, subtype = _DEVICE_TYPE_DIMMABLE_RELAY, "0"
+            elif i % 7 == 0:
+                devType, subtype = _DEVICE_TYPE_COLOR_LIGHT, _COLOR_LIGHT_SUBTYPE
+            else:
+                devType, subtype = _DEVICE_TYPE_DEFAULT, "0"
+
+            devices["aux_%d" % i] = {
+                "state": "0",
+                "label": "AUX%d" % i,
+                "icon": "aux_%d_0.png" % i,
+                "type": devType,
+                "subtype": subtype,
+            }
+
+        return devices
+
+    # reset the request counters
+    def resetCounters(self):
+        with self._lock:
+            self.requestCounts.clear()
+
+    # get the total number of requests received since the counters were reset
+    def getRequestCount(self):
+        with self._lock:
+            return sum(self.requestCounts.values())
+
+    # get the current (applied) state value for a home screen attribute or aux relay field
+    def getValue(self, serialNum, name, field="state"):
+        with self._lock:
+            self._applyPending()
+            system = self.systems[serialNum]
+            if name in system["home"]:
+                return system["home"][name]
+            else:
+                return system["devices"][name][field]
+
+    # apply the state changes from set_* commands that are due
+    def _applyPending(self):
+        currentTime = time.time()
+        while self._pending and self._pending[0][0] <= currentTime:
+            target, key, value = self._pending.pop(0)[1:]
+            target[key] = value
+
+    # get the value of a state attribute including changes not yet applied
+    def _effectiveValue(self, target, key):
+        for pending in reversed(self._pending):
+            if pending[1] is target and pending[2] == key:
+                return pending[3]
+        return target[key]
+
+    # schedule a state change to be applied after the apply delay
+    def _setValue(self, target, key, value):
+        self._pending.append((time.time() + self.applyDelay, target, key, value))
+
+    # format the home screen response for a system
+    @staticmethod
+    def _homeScreen(system):
+        return {"home_screen": [{key: value} for key, value in system["home"].items()]}
+
+    # format the devices screen response for a system
+    @staticmethod
+    def _devicesScreen(system):
+        screen = [{"status": system["home"]["status"]}, {"response": ""}, {"group": "1"}]
+        for devID, device in system["devices"].items():
+            screen.append({devID: [{key: value} for key, value in device.items()]})
+        return {"devices_screen": screen}
+
+    # process a request and return the HTTP status code and response data
+    def handle(self, method, path, query, body):
+
+        # simulate latency, stalls, and errors
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            stall = self._random.random() < self.stallRate
+            error = self._random.random() < self.errorRate
+        time.sleep(self.stallTime if stall else delay)
+
+        if path == _PATH_LOGIN and method == "POST":
+            command = "login"
+        elif path == _PATH_SYSTEMS and method == "GET":
+            command = "devices.json"
+        elif path == _PATH_SESSION and method == "GET":
+            command = query.get("command", "")
+        else:
+            return (404, {"message": "Not Found"})
+
+        with self._lock:
+            self.requestCounts[command] += 1
+
+        if error:
+            return (500, {"message": "Simulated error"})
+
+        if command == "login":
+            return (200, {
+                "id": 1,
+                "email": body.get("email", ""),
+                "session_id": "mocksession%d" % int(time.time()),
+                "authentication_token": "mocktoken",
+            })
+
+        elif command == "devices.json":
+            return (200, [
+                {"id": system["id"], "serial_number": serialNum, "name": system["name"], "device_type": "iaqua"}
+                for serialNum, system in self.systems.items()
+            ])
+
+        # remainder are session commands for a specific system
+        system = self.systems.get(query.get("serial"))
+        if system is None:
+            return (200, {"message": "Device offline."})
+
+        with self._lock:
+
+            self._applyPending()
+            home = system["home"]
+            devices = system["devices"]
+
+            if command == "get_home":
+                return (200, self._homeScreen(system))
+
+            elif command == "get_devices":
+                return (200, self._devicesScreen(system))
+
+            elif command in ("set_pool_pump", "set_spa_pump"):
+                key = command[4:]
+                self._setValue(home, key, "0" if self._effectiveValue(home, key) == "1" else "1")
+                return (200, self._homeScreen(system))
+
+            elif command in ("set_pool_heater", "set_spa_heater", "set_solar_heater"):
+                key = command[4:]
+                value = _HEATER_STATE_OFF if self._effectiveValue(home, key) != _HEATER_STATE_OFF else _HEATER_STATE_ENABLED
+                self._setValue(home, key, value)
+                return (200, self._homeScreen(system))
+
+            elif command == "set_temps":
+
+                # temp1 is the spa setpoint and temp2 the pool setpoint if the system has a spa
+                if home["spa_pump"] != "":
+                    keys = {"temp1": "spa_set_point", "temp2": "pool_set_point"}
+                else:
+                    keys = {"temp1": "pool_set_point"}
+                for param, key in keys.items():
+                    if param in query:
+                        self._setValue(home, key, query[param])
+                return (200, self._homeScreen(system))
+
+            elif command == "set_light":
+                device = devices.get("aux_" + query.get("aux", ""))
+                if device is None:
+                    return (200, {"message": "Invalid aux."})
+                light = query.get("light", "0")
+                self._setValue(device, "state", "0" if light == "0" else "1")
+                if device["type"] == _DEVICE_TYPE_DIMMABLE_RELAY:
+                    self._setValue(device, "subtype", light)
+                return (200, self._devicesScreen(system))
+
+            elif command.startswith("set_aux_"):
+                device = devices.get(command[4:])
+                if device is None:
+                    return (200, {"message": "Invalid aux."})
+                self._setValue(device, "state", "0" if self._effectiveValue(device, "state") == "1" else "1")
+                return (200, self._devicesScreen(system))
+
+            else:
+                return (200, {"message": "Unknown command."})
+
+# HTTP request handler that passes requests to the simulated service
+class _MockRequestHandler(BaseHTTPRequestHandler):
+
+    # keep connections alive like the iAquaLink service does
+    protocol_version = "HTTP/1.1"
+
+    def _process(self, method):
+
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        # read the JSON body, if any
+        body = {}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                pass
+
+        status, data = self.server.service.handle(method, url.path, query, body)
+
+        # the client may have given up on the request (e.g., timed out) while the response was delayed
+        payload = json.dumps(data).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if method != "HEAD":
+                self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_GET(self):
+        self._process("GET")
+
+    def do_POST(self):
+        self._process("POST")
+
+    def do_HEAD(self):
+        self._process("HEAD")
+
+    # route the request log to the module logger
+    def log_message(self, format, *args):
+        _LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+# Threaded HTTP server for the simulated service
+class MockAqualinkServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    service = None
+    _thread = None
+
+    def __init__(self, service, host="127.0.0.1", port=0):
+        super(MockAqualinkServer, self).__init__((host, port), _MockRequestHandler)
+        self.service = service
+
+    # base URL of the server for the apiHost parameter of iAqualinkConnection
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    # serve requests on a background thread
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="iAquaMock", daemon=True)
+        self._thread.start()
+        return self
+
+    # stop serving requests and close the socket
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# Main function to run the stand-in service from the command line
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the iAquaLink cloud service API.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--systems", type=int, default=1, help="number of systems (pool controllers)")
+    parser.add_argument("--aux", type=int, default=7, help="number of aux relays per system")
+    parser.add_argument("--latency", type=float, default=0.0, help="base response latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random latency added (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests held for --stall-time")
+    parser.add_argument("--stall-time", type=float, default=_DEFAULT_STALL_TIME, help="time a stalled request is held (seconds)")
+    parser.add_argument("--apply-delay", type=float, default=0.0, help="delay before set_* commands change the state (seconds)")
+    parser.add_argument("--extra-attributes", type=int, default=0, help="filler attributes added to each home screen")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random number generator")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    service = MockAqualinkService(
+        systems=args.systems,
+        auxDevices=args.aux,
+        latency=args.latency,
+        jitter=args.jitter,
+        errorRate=args.error_rate,
+        stallRate=args.stall_rate,
+        stallTime=args.stall_time,
+        applyDelay=args.apply_delay,
+        extraAttributes=args.extra_attributes,
+        seed=args.seed,
+    )
+    server = MockAqualinkServer(service, args.host, args.port)
+
+    _LOGGER.info("Serving iAquaLink stand-in for %d system(s) at %s", args.systems, server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    sys.exit(0)